@@ -0,0 +1,199 @@
+"""
+Cached, lazily evaluated analysis graph, run on a pool of worker threads
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AnalysisCancelled(Exception):
+    """
+    Raised inside a job once it has been cancelled
+    """
+
+
+class _Node:
+    def __init__(self, func, deps, params, inputs):
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        self.inputs = tuple(inputs)
+
+
+class AnalysisJob:
+    """
+    Handle to an analysis running in the background, keeping the recording key, inputs and
+    parameters it was submitted with so its results can be matched to the right recording
+    """
+    def __init__(self, name=None, recording_key=None, inputs=None, params=None):
+        self.name = name
+        self.recording_key = recording_key
+        self.inputs = inputs
+        self.params = params
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        """
+        Stops the job before its next node, or before it starts at all
+        """
+        self.cancel_event.set()
+        self.future.cancel()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class AnalysisGraph:
+    """
+    Graph of analysis steps. Each node is a function whose keyword arguments are the results
+    of the nodes it depends on, its parameters and inputs taken from the recording.
+    Results are cached by recording key, node and the parameters the node (or anything it
+    depends on) uses, so changing one parameter only recomputes the nodes downstream of it.
+    """
+    def __init__(self, workers=2):
+        self.nodes = {}
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def add(self, name, func, deps=(), params=(), inputs=()):
+        """
+        Adds a node to the graph
+        :param name: Name of node
+        :type name: string
+        :param func: Function computing the node
+        :type func: callable
+        :param deps: Names of the nodes whose results are passed to func
+        :type deps: sequence
+        :param params: Names of the analysis parameters passed to func
+        :type params: sequence
+        :param inputs: Names of the recording inputs passed to func
+        :type inputs: sequence
+        """
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError("Unknown node %s" % dep)
+        self.nodes[name] = _Node(func, deps, params, inputs)
+
+    def _order(self, name):
+        # Dependencies first, each node once
+        order = []
+
+        def visit(node):
+            if node in order:
+                return
+            for dep in self.nodes[node].deps:
+                visit(dep)
+            order.append(node)
+        visit(name)
+        return order
+
+    def _used_params(self, name):
+        used = set()
+        for node in self._order(name):
+            used.update(self.nodes[node].params)
+        return sorted(used)
+
+    def key(self, name, recording_key, params):
+        """
+        :return: Cache key of a node, only including parameters that affect it
+        :rtype: tuple
+        """
+        return (recording_key, name, tuple((param, params[param]) for param in self._used_params(name)))
+
+    def cached(self, name, recording_key, params):
+        """
+        :return: Whether the node already has a cached result
+        :rtype: bool
+        """
+        with self.lock:
+            return self.key(name, recording_key, params) in self.cache
+
+    def compute(self, name, recording_key, inputs, params, progress=None, cancel_event=None):
+        """
+        Computes a node and everything it depends on, using cached results where possible
+        :param name: Name of node
+        :type name: string
+        :param recording_key: Hashable value identifying the recording
+        :param inputs: Recording inputs, e.g. waveform and sampling_freq
+        :type inputs: dict
+        :param params: Analysis parameters
+        :type params: dict
+        :param progress: Called with (node name, nodes done, nodes total) after each node
+        :type progress: callable
+        :param cancel_event: Computation stops with AnalysisCancelled once this is set
+        :type cancel_event: threading.Event
+        :return: Result of node
+        """
+        order = self._order(name)
+        results = {}
+        for i, node_name in enumerate(order):
+            if cancel_event is not None and cancel_event.is_set():
+                raise AnalysisCancelled(node_name)
+            key = self.key(node_name, recording_key, params)
+            with self.lock:
+                hit = key in self.cache
+                if hit:
+                    results[node_name] = self.cache[key]
+            if not hit:
+                node = self.nodes[node_name]
+                kwargs = {dep: results[dep] for dep in node.deps}
+                kwargs.update({param: params[param] for param in node.params})
+                kwargs.update({item: inputs[item] for item in node.inputs})
+                results[node_name] = node.func(**kwargs)
+                with self.lock:
+                    # A cancelled job's recording may have been cleared already, its results would never be freed
+                    if cancel_event is None or not cancel_event.is_set():
+                        self.cache[key] = results[node_name]
+            if progress is not None:
+                progress(node_name, i + 1, len(order))
+        return results[name]
+
+    def submit(self, name, recording_key, inputs, params, progress=None):
+        """
+        Computes a node on the worker pool
+        :return: Job handle, its result is the node's result
+        :rtype: AnalysisJob
+        """
+        job = AnalysisJob(name, recording_key, inputs, params)
+        job.future = self.executor.submit(self.compute, name, recording_key, inputs, params,
+                                          progress, job.cancel_event)
+        return job
+
+    def clear(self, recording_key=None):
+        """
+        Drops cached results, of one recording or all of them
+        """
+        with self.lock:
+            if recording_key is None:
+                self.cache.clear()
+                return
+            for key in [key for key in self.cache if key[0] == recording_key]:
+                del self.cache[key]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
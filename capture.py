@@ -0,0 +1,161 @@
+"""
+Raw serial capture and replay, so ecg_read can be tested against real recordings from the device
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+import time
+
+# File starts with this, then one record per read: timestamp (s), byte count, bytes
+MAGIC = b'SYSCAP1\n'
+RECORD = struct.Struct('<dI')
+
+
+class CaptureSerial:
+    """
+    Wraps a serial object and records every read to a file, exactly as the bytes arrived
+    Everything other than read is passed through to the wrapped serial object
+    """
+    def __init__(self, ser, name):
+        self.ser = ser
+        self.file = open(name, 'wb')
+        self.file.write(MAGIC)
+        self.start = time.perf_counter()
+
+    def __getattr__(self, attr):
+        return getattr(self.ser, attr)
+
+    def read(self, size=1):
+        """
+        Reads from the wrapped serial object and records the bytes with a timestamp
+        """
+        data = self.ser.read(size)
+        # ecg_read polls constantly, so empty reads are left out to keep captures small
+        if len(data) == 0:
+            return data
+        self.file.write(RECORD.pack(time.perf_counter() - self.start, len(data)))
+        self.file.write(data)
+        return data
+
+    def close(self):
+        """
+        Closes the capture file, the wrapped serial object stays open
+        """
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_capture(name):
+    """
+    Loads a capture made by CaptureSerial
+    :param name: File name of capture
+    :type name: string
+    :return: Timestamp and bytes of every read
+    :rtype: list
+    """
+    records = []
+    with open(name, 'rb') as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a Systolic capture file")
+        while True:
+            header = capture.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            timestamp, size = RECORD.unpack(header)
+            records.append((timestamp, capture.read(size)))
+    return records
+
+
+class ReplaySerial:
+    """
+    Stands in for a serial object and feeds a capture back, one recorded read at a time,
+    so ecg_read sees the same byte boundaries as it did with the device.
+    With realtime set, each read only becomes available once as much time has passed as
+    it did during capture, otherwise it is replayed as fast as possible.
+    Once the capture runs out, inWaiting and read raise EOFError rather than waiting forever
+    like a silent device would, so size ecg_read's data_limit with the samples property.
+    """
+    def __init__(self, name, realtime=False):
+        self.records = load_capture(name)
+        self.realtime = realtime
+        self.index = 0
+        self.start = None
+        # Commands sent to the device, kept for checking what ecg_read sent
+        self.written = []
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def samples(self):
+        """
+        :return: Amount of samples ecg_read gets from the capture, one per read containing a number
+        :rtype: int
+        """
+        return sum(1 for _, data in self.records if any(chr(byte).isdigit() for byte in data))
+
+    def _ready(self):
+        if self.index >= len(self.records):
+            raise EOFError("End of capture")
+        if not self.realtime:
+            return True
+        if self.start is None:
+            self.start = time.perf_counter() - self.records[self.index][0]
+        return time.perf_counter() - self.start >= self.records[self.index][0]
+
+    def inWaiting(self):
+        """
+        :return: Size of the next recorded read, or 0 if it has not arrived yet
+        :rtype: int
+        """
+        if not self._ready():
+            return 0
+        return len(self.records[self.index][1])
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def read(self, size=1):
+        """
+        Returns the next recorded read, cut down to size if needed
+        """
+        if not self._ready():
+            return b''
+        data = self.records[self.index][1]
+        if size < len(data):
+            self.records[self.index] = (self.records[self.index][0], data[size:])
+            return data[:size]
+        self.index += 1
+        return data
+
+    def write(self, data):
+        self.written.append(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        pass
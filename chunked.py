@@ -0,0 +1,139 @@
+"""
+Chunk-parallel filtering of very long recordings
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import signal
+
+# Recordings shorter than this (samples) are filtered in one go
+CHUNK_SIZE = 1 << 20
+# The filter's transient is allowed to decay to this fraction before the padding ends
+TOLERANCE = 1e-10
+
+
+def transient_length(z, p, k=None, tol=TOLERANCE):
+    """
+    Amount of samples for an IIR filter's response to decay to tol, worked out from its slowest pole
+    :param z: Zeros, only used when there are no poles (FIR)
+    :param p: Poles
+    :type p: ndarray
+    :param tol: Fraction the response has to decay to
+    :type tol: float
+    :return: Transient length (samples)
+    :rtype: int
+    """
+    radius = np.max(np.abs(p)) if len(p) else 0
+    if radius == 0:
+        return len(z) + 1
+    if radius >= 1:
+        raise ValueError("Filter is not stable")
+    return int(math.ceil(math.log(tol) / math.log(radius))) + len(p)
+
+
+def chunked_apply(func, data, pad, chunk_size=CHUNK_SIZE, workers=None):
+    """
+    Applies func to overlapping chunks of data on a thread pool and stitches the results.
+    Each chunk is extended by pad samples on both sides (where the data allows), so edge
+    effects of func stay in the padding and are cut off.
+    scipy's filters release the GIL, so threads run them in parallel.
+    :param func: Function taking and returning an array filtered along the last axis
+    :type func: callable
+    :param data: Data, samples along the last axis
+    :type data: ndarray
+    :param pad: Samples added on each side of a chunk, at least func's transient length
+    :type pad: int
+    :param chunk_size: Samples per chunk
+    :type chunk_size: int
+    :param workers: Amount of threads, defaults to the amount of CPUs
+    :type workers: int
+    :return: Filtered data
+    :rtype: ndarray
+    """
+    data = np.asarray(data)
+    length = data.shape[-1]
+    if length <= chunk_size:
+        return func(data)
+
+    def run(start):
+        end = min(start + chunk_size, length)
+        low = max(start - pad, 0)
+        high = min(end + pad, length)
+        return func(data[..., low:high])[..., start - low:end - low]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        chunks = list(executor.map(run, range(0, length, chunk_size)))
+    return np.concatenate(chunks, axis=-1)
+
+
+def chunked_sosfilt(sos, data, chunk_size=CHUNK_SIZE, workers=None):
+    """
+    signal.sosfilt over chunks in parallel. Only the samples before a chunk affect it, so
+    it is started early by the filter's transient length.
+    """
+    pad = transient_length(*signal.sos2zpk(sos))
+    return chunked_apply(lambda chunk: signal.sosfilt(sos, chunk), data, pad, chunk_size, workers)
+
+
+def chunked_filtfilt(b, a, data, chunk_size=CHUNK_SIZE, workers=None):
+    """
+    signal.filtfilt over chunks in parallel. Both passes have a transient, so chunks are
+    padded on both sides. At the ends of the data the chunks reach the real edge, where
+    filtfilt extends the data exactly as it does for the whole array.
+    """
+    pad = transient_length(*signal.tf2zpk(b, a)) + 3 * max(len(a), len(b))
+    return chunked_apply(lambda chunk: signal.filtfilt(b, a, chunk), data, pad, chunk_size, workers)
+
+
+def benchmark(hours=24, sampling_freq=500, workers=None):
+    """
+    Times whole-array and chunked filtering of a long lead, and checks they match
+    :param hours: Length of the test lead (hours)
+    :type hours: float
+    :param sampling_freq: Sampling frequency (Hz)
+    :type sampling_freq: float
+    :param workers: Amount of threads
+    :type workers: int
+    """
+    lead = np.random.default_rng(0).normal(size=int(hours * 3600 * sampling_freq))
+    sos = signal.butter(2, [5, 15], btype='bandpass', output='sos', fs=sampling_freq)
+    b_notch, a_notch = signal.iirnotch(50.0, 30.0, sampling_freq)
+    tests = [('sosfilt', lambda: signal.sosfilt(sos, lead), lambda: chunked_sosfilt(sos, lead, workers=workers)),
+             ('filtfilt', lambda: signal.filtfilt(b_notch, a_notch, lead),
+              lambda: chunked_filtfilt(b_notch, a_notch, lead, workers=workers))]
+    print("%d samples, %d threads" % (len(lead), workers or os.cpu_count()))
+    for name, whole, chunked in tests:
+        start = time.perf_counter()
+        expected = whole()
+        whole_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result = chunked()
+        chunked_time = time.perf_counter() - start
+        print("%s: whole %.2f s, chunked %.2f s, speedup %.1fx, max difference %.1e"
+              % (name, whole_time, chunked_time, whole_time / chunked_time, np.abs(result - expected).max()))
+
+
+if __name__ == '__main__':
+    # e.g. python chunked.py 24 to filter a 24 hour lead
+    import sys
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 24)
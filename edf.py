@@ -0,0 +1,340 @@
+"""
+EDF+ export written while sampling, and a reader that seeks straight to any time in the file
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import datetime
+
+import numpy as np
+
+from recording import counts_to_millivolts
+
+# Format specification: https://www.edfplus.info/specs/edfplus.html
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+DIGITAL_MIN = -32768
+DIGITAL_MAX = 32767
+ANNOTATION_LABEL = 'EDF Annotations'
+# Default physical range (+/- mV) around each lead's baseline, 0.3 uV per step
+BASELINE_RANGE = 10.0
+# Bytes per data record for the time-keeping annotation, enough for "+<onset>" of a multi-day file
+ANNOTATION_BYTES = 32
+
+
+def _field(value, width):
+    text = str(value)
+    if len(text) > width:
+        raise ValueError("%s does not fit in %d characters" % (text, width))
+    return text.ljust(width).encode('ascii')
+
+
+def _number(value, width=8):
+    # EDF numbers are ASCII, trimmed to fit their field
+    text = repr(float(value)) if not float(value).is_integer() else str(int(value))
+    return _field(text[:width].rstrip('.'), width)
+
+
+def _annotation(onset):
+    # Time-keeping TAL: +onset, two separators and a terminating zero, padded with zeros
+    tal = ('+%s' % repr(float(onset)).rstrip('0').rstrip('.')).encode('ascii') + b'\x14\x14\x00'
+    return tal.ljust(ANNOTATION_BYTES, b'\x00')
+
+
+class EDFWriter:
+    """
+    Writes an EDF+ file one data record at a time, so it can be filled in while sampling.
+    Samples are given in millivolts and stored as 16 bit values between physical_min and
+    physical_max, at a resolution of (physical_max - physical_min) / 65535.
+    The range from ADCMAX (see adc_range) fits the full ADC output including the electrode
+    offset, but at around 21 uV per step, well above the noise floor. With remove_baseline the
+    offset of each lead (its mean over the first data record) is taken off before storing, so a
+    range of a few mV around zero can be used instead, e.g. +/-BASELINE_RANGE gives 0.3 uV per step,
+    well below the front end's noise, which is what the ECG Window records with by default.
+    Samples outside the range are clipped. EDF is kept over 24 bit BDF for the wider reader support.
+    Works as an ecg_read listener, taking the measured leads from the ADC count buffer.
+    """
+    def __init__(self, name, labels, sampling_rate, physical_min, physical_max, adc_max=None,
+                 record_duration=1.0, patient='X X X X', start=None, remove_baseline=False):
+        """
+        :param name: File name (include .edf)
+        :type name: string
+        :param labels: Lead headers, e.g. Lead I, Lead II, Lead III
+        :type labels: list
+        :param sampling_rate: Sampling rate (Hz), can be corrected on close
+        :type sampling_rate: float
+        :param physical_min: Lowest value stored (mV)
+        :type physical_min: float
+        :param physical_max: Highest value stored (mV)
+        :type physical_max: float
+        :param adc_max: ADCMAX, needed when used as an ecg_read listener
+        :type adc_max: int
+        :param record_duration: Length of each data record (seconds)
+        :type record_duration: float
+        :param patient: EDF+ patient field
+        :type patient: string
+        :param start: Start of the recording, defaults to now
+        :type start: datetime.datetime
+        :param remove_baseline: Subtract each lead's mean over the first data record from all samples
+        :type remove_baseline: bool
+        """
+        self.labels = list(labels)
+        # Kept as they are written in the header, so the scaling matches what readers see
+        self.physical_min = float(_number(physical_min))
+        self.physical_max = float(_number(physical_max))
+        self.adc_max = adc_max
+        self.patient = patient
+        self.start = start or datetime.datetime.now()
+        self.samples_per_record = max(int(round(sampling_rate * record_duration)), 1)
+        self.record_duration = float(_number(self.samples_per_record / sampling_rate))
+        self.records = 0
+        self.received = 0
+        self.buffer = None
+        self.count = 0
+        self.pending = np.zeros((len(self.labels), 0))
+        self.remove_baseline = remove_baseline
+        self.baseline = None
+        self.file = open(name, 'w+b')
+        self.file.write(self._header(-1))
+
+    def _header(self, records):
+        signals = self.labels + [ANNOTATION_LABEL]
+        leads = len(self.labels)
+        start = self.start
+        recording = 'Startdate %02d-%s-%04d X X Systolic' % (start.day, MONTHS[start.month - 1], start.year)
+        header = b''.join([
+            _field('0', 8), _field(self.patient, 80), _field(recording, 80),
+            _field(start.strftime('%d.%m.%y'), 8), _field(start.strftime('%H.%M.%S'), 8),
+            _field(256 * (len(signals) + 1), 8), _field('EDF+C', 44), _field(records, 8),
+            _number(self.record_duration), _field(len(signals), 4)])
+        header += b''.join(_field(label, 16) for label in signals)
+        header += b''.join(_field('', 80) for _ in signals)  # transducer
+        header += b''.join(_field('mV', 8) for _ in range(leads)) + _field('', 8)
+        header += b''.join(_number(self.physical_min) for _ in range(leads)) + _field(-1, 8)
+        header += b''.join(_number(self.physical_max) for _ in range(leads)) + _field(1, 8)
+        header += b''.join(_field(DIGITAL_MIN, 8) for _ in signals)
+        header += b''.join(_field(DIGITAL_MAX, 8) for _ in signals)
+        header += b''.join(_field('HP:DC', 80) for _ in range(leads)) + _field('', 80)
+        header += b''.join(_field(self.samples_per_record, 8) for _ in range(leads))
+        header += _field(ANNOTATION_BYTES // 2, 8)
+        header += b''.join(_field('', 32) for _ in signals)
+        return header
+
+    @property
+    def record_bytes(self):
+        return len(self.labels) * self.samples_per_record * 2 + ANNOTATION_BYTES
+
+    def _digital(self, data):
+        scale = (DIGITAL_MAX - DIGITAL_MIN) / (self.physical_max - self.physical_min)
+        digital = np.round((data - self.physical_min) * scale + DIGITAL_MIN)
+        return np.clip(digital, DIGITAL_MIN, DIGITAL_MAX).astype('<i2')
+
+    def write(self, data):
+        """
+        Adds samples, writing every data record that is complete
+        :param data: Samples in millivolts, shape (leads, samples)
+        :type data: ndarray
+        """
+        self.pending = np.concatenate((self.pending, np.asarray(data, dtype=float)), axis=1)
+        complete = self.pending.shape[1] // self.samples_per_record
+        if complete == 0:
+            return
+        used = complete * self.samples_per_record
+        if self.remove_baseline and self.baseline is None:
+            self.baseline = self.pending[:, :self.samples_per_record].mean(axis=1, keepdims=True)
+        if self.baseline is not None:
+            self.pending[:, :used] -= self.baseline
+        # (leads, records, samples) to (records, leads, samples), the layout of the data records
+        digital = self._digital(self.pending[:, :used])
+        digital = digital.reshape(len(self.labels), complete, self.samples_per_record).transpose(1, 0, 2)
+        for record in digital:
+            self.file.write(record.tobytes())
+            self.file.write(_annotation(self.records * self.record_duration))
+            self.records += 1
+        self.pending = self.pending[:, used:]
+
+    def update(self, counts, count):
+        """
+        Listener for ecg_read, writes the measured leads once a data record is complete
+        """
+        # Kept so close can write the samples after the last complete record
+        self.buffer = counts
+        self.count = count
+        if count - self.received >= self.samples_per_record:
+            self._write_received()
+
+    def _write_received(self):
+        leads = self.buffer[:len(self.labels), self.received:self.count]
+        self.write(counts_to_millivolts(leads, self.adc_max))
+        self.received = self.count
+
+    def close(self, sampling_rate=None):
+        """
+        Writes any remaining samples (padded to a full data record) and the final header
+        :param sampling_rate: Measured sampling rate, corrects the record duration if given
+        :type sampling_rate: float
+        """
+        if self.buffer is not None and self.count > self.received:
+            self._write_received()
+        if self.pending.shape[1] > 0:
+            if self.remove_baseline and self.baseline is None:
+                # Shorter than a data record, the baseline comes from what there is
+                self.baseline = self.pending.mean(axis=1, keepdims=True)
+            padding = self.samples_per_record - self.pending.shape[1]
+            self.write(np.pad(self.pending, ((0, 0), (0, padding)), mode='edge'))
+        if sampling_rate is not None:
+            self.record_duration = float(_number(self.samples_per_record / sampling_rate))
+            # Onsets depend on the record duration, so the time-keeping annotations are rewritten
+            header_bytes = 256 * (len(self.labels) + 2)
+            for record in range(self.records):
+                self.file.seek(header_bytes + (record + 1) * self.record_bytes - ANNOTATION_BYTES)
+                self.file.write(_annotation(record * self.record_duration))
+        self.file.seek(0)
+        self.file.write(self._header(self.records))
+        self.file.close()
+
+
+def adc_range(adc_max):
+    """
+    Physical range covering everything the ADC can output
+    :param adc_max: ADCMAX from the lookup table
+    :type adc_max: int
+    :return: Physical minimum and maximum (mV)
+    :rtype: float, float
+    """
+    return float(counts_to_millivolts(0, adc_max)), float(counts_to_millivolts(adc_max, adc_max))
+
+
+def export_recording(name, recording, labels, physical_range=None, chunk_size=1 << 16):
+    """
+    Writes the measured leads of a Recording to EDF+, a chunk at a time, with each lead's mean
+    taken off. Unless given, the physical range is the smallest one fitting every lead, so the
+    16 bit samples are spread over the signal rather than the whole ADC range.
+    :param name: File name (include .edf)
+    :type name: string
+    :param recording: Recording from ecg_read
+    :type recording: Recording
+    :param labels: Headers of the measured leads
+    :type labels: list
+    :param physical_range: Physical minimum and maximum (mV), samples outside it are clipped
+    :type physical_range: float, float
+    """
+    leads = len(labels)
+    counts = recording.counts[:leads]
+    if counts.shape[1] == 0:
+        baseline = np.zeros((leads, 1))
+        physical_range = physical_range or (-1.0, 1.0)
+    else:
+        # The conversion is linear, so it can be applied to the mean and extremes of the counts
+        baseline = counts_to_millivolts(counts.sum(axis=1, keepdims=True, dtype=np.int64) / counts.shape[1],
+                                        recording.adc_max)
+    if physical_range is None:
+        low = counts_to_millivolts(counts.min(axis=1, keepdims=True), recording.adc_max) - baseline
+        high = counts_to_millivolts(counts.max(axis=1, keepdims=True), recording.adc_max) - baseline
+        # Rounded outwards to 0.1 mV, the header only has room for 8 characters
+        physical_range = np.floor(low.min() * 10) / 10 - 0.1, np.ceil(high.max() * 10) / 10 + 0.1
+    writer = EDFWriter(name, labels, recording.sampling_rate, *physical_range, recording.adc_max)
+    for start in range(0, recording.counts.shape[1], chunk_size):
+        chunk = counts_to_millivolts(recording.counts[:leads, start:start + chunk_size], recording.adc_max)
+        writer.write(chunk - baseline)
+    writer.close()
+
+
+class EDFReader:
+    """
+    Reads EDF/EDF+ files. Data records all have the same size, so any time range is read by
+    seeking straight to its first record, without loading the rest of the file.
+    """
+    def __init__(self, name):
+        self.file = open(name, 'rb')
+        header = self.file.read(256)
+        self.header_bytes = int(header[184:192])
+        self.records = int(header[236:244])
+        self.record_duration = float(header[244:252])
+        signals = int(header[252:256])
+        fields = self.file.read(256 * signals)
+
+        def column(offset, width):
+            start = offset * signals
+            return [fields[start + i * width:start + (i + 1) * width].decode('ascii').strip()
+                    for i in range(signals)]
+        labels = column(0, 16)
+        physical_min = np.array(column(104, 8), dtype=float)
+        physical_max = np.array(column(112, 8), dtype=float)
+        digital_min = np.array(column(120, 8), dtype=float)
+        digital_max = np.array(column(128, 8), dtype=float)
+        self.samples_per_record = np.array(column(216, 8), dtype=int)
+        self.record_bytes = int(self.samples_per_record.sum()) * 2
+        if self.records < 0:
+            # Writing was never finished, work it out from the file size
+            self.file.seek(0, 2)
+            self.records = (self.file.tell() - self.header_bytes) // self.record_bytes
+        # Offset of each signal within a data record
+        self.offsets = np.concatenate(([0], np.cumsum(self.samples_per_record)[:-1]))
+        self.signals = [i for i, label in enumerate(labels) if label != ANNOTATION_LABEL]
+        self.labels = [labels[i] for i in self.signals]
+        self.gain = (physical_max - physical_min) / (digital_max - digital_min)
+        self.offset = physical_min - digital_min * self.gain
+        self.sampling_rates = self.samples_per_record / self.record_duration
+
+    @property
+    def duration(self):
+        """
+        :return: Length of the recording (seconds)
+        :rtype: float
+        """
+        return self.records * self.record_duration
+
+    def read(self, start=0.0, duration=None):
+        """
+        Reads a time range of every lead
+        :param start: Time offset (seconds)
+        :type start: float
+        :param duration: Length to read (seconds), to the end if None
+        :type duration: float
+        :return: Samples in physical units, shape (leads, samples); leads must share a sampling rate
+        :rtype: ndarray
+        """
+        samples = self.samples_per_record[self.signals[0]]
+        rate = self.sampling_rates[self.signals[0]]
+        first = int(round(start * rate))
+        last = self.records * samples
+        if duration is not None:
+            last = min(first + int(round(duration * rate)), last)
+        if last <= first:
+            return np.zeros((len(self.signals), 0))
+        first_record = first // samples
+        last_record = -(-last // samples)
+        self.file.seek(self.header_bytes + first_record * self.record_bytes)
+        raw = np.frombuffer(self.file.read((last_record - first_record) * self.record_bytes), dtype='<i2')
+        raw = raw.reshape(last_record - first_record, self.record_bytes // 2)
+        data = np.empty((len(self.signals), (last_record - first_record) * samples))
+        for row, signal_index in enumerate(self.signals):
+            offset = self.offsets[signal_index]
+            digital = raw[:, offset:offset + samples].reshape(-1)
+            data[row] = digital * self.gain[signal_index] + self.offset[signal_index]
+        skip = first - first_record * samples
+        return data[:, skip:skip + last - first]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,97 @@
+"""
+Beat ensemble averaging, used to get a low-noise template beat out of many noisy ones
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from mathtools import sliding_windows
+
+
+def beat_windows(waveforms, peaks, before, after):
+    """
+    Aligns a fixed-length window around each R-peak on every lead
+    Beats too close to either end of the recording to fit a full window are dropped, so a
+    recording shorter than before + after gives no beats
+    :param waveforms: ECG data, one row per lead
+    :type waveforms: ndarray
+    :param peaks: Sample index of each R-peak
+    :type peaks: array
+    :param before: Samples kept before the peak
+    :type before: int
+    :param after: Samples kept after the peak (peak included)
+    :type after: int
+    :return: Beat windows of shape (leads, beats, before + after), and the peaks that were kept
+    :rtype: ndarray, ndarray
+    """
+    waveforms = np.atleast_2d(np.asarray(waveforms))
+    peaks = np.asarray(peaks, dtype=int)
+    length = before + after
+    peaks = peaks[(peaks - before >= 0) & (peaks + after <= waveforms.shape[1])]
+    # Every possible window as a view of the original data, nothing is copied here
+    windows = sliding_windows(waveforms, length)
+    # One gather for all beats rather than a copy per beat
+    return windows[:, peaks - before], peaks
+
+
+def beat_correlation(windows, template):
+    """
+    Pearson correlation of every beat to the template, per lead
+    :param windows: Beat windows, shape (leads, beats, samples)
+    :type windows: ndarray
+    :param template: Template beat, shape (leads, samples)
+    :type template: ndarray
+    :return: Correlation of shape (leads, beats)
+    :rtype: ndarray
+    """
+    beats = windows - windows.mean(axis=-1, keepdims=True)
+    template = template - template.mean(axis=-1, keepdims=True)
+    numerator = np.einsum('lbs,ls->lb', beats, template)
+    denominator = np.sqrt(np.einsum('lbs,lbs->lb', beats, beats)
+                          * np.einsum('ls,ls->l', template, template)[:, np.newaxis])
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def ensemble_average(waveforms, peaks, sampling_freq, before=0.25, after=0.45):
+    """
+    Computes median and mean template beats from detected R-peaks
+    :param waveforms: ECG data, one row per lead
+    :type waveforms: ndarray
+    :param peaks: Sample index of each R-peak
+    :type peaks: array
+    :param sampling_freq: Sampling frequency (Hz)
+    :type sampling_freq: float
+    :param before: Time kept before each peak (seconds)
+    :type before: float
+    :param after: Time kept after each peak (seconds)
+    :type after: float
+    :return: Median template, mean template (both (leads, samples)), correlation of each beat
+             to the median template (leads, beats) and the peaks used
+    :rtype: ndarray, ndarray, ndarray, ndarray
+    """
+    before = int(round(before * sampling_freq))
+    after = int(round(after * sampling_freq))
+    windows, peaks = beat_windows(waveforms, peaks, before, after)
+    if len(peaks) == 0:
+        empty = np.zeros((windows.shape[0], before + after))
+        return empty, empty.copy(), np.zeros((windows.shape[0], 0)), peaks
+    median = np.median(windows, axis=1)
+    mean = windows.mean(axis=1)
+    correlation = beat_correlation(windows, median)
+    return median, mean, correlation, peaks
@@ -21,6 +21,7 @@ along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 import matplotlib.pyplot as plt
+from numpy.lib.stride_tricks import as_strided
 
 
 def mean_downscaler(data, n):
@@ -47,3 +48,20 @@ def mean_downscaler(data, n):
             continue
     # Return final array
     return finalArr
+
+
+def sliding_windows(data, length):
+    """
+    Every window of length samples along the last axis, as a read-only view (nothing is copied)
+    Same as numpy's sliding_window_view, which needs a newer numpy than requirements.txt pins
+    :param data: Input data
+    :type data: ndarray
+    :param length: Window length
+    :type length: int
+    :return: View of shape (..., windows, length), with no windows if data is shorter than length
+    :rtype: ndarray
+    """
+    data = np.asarray(data)
+    count = max(data.shape[-1] - length + 1, 0)
+    return as_strided(data, shape=data.shape[:-1] + (count, length),
+                      strides=data.strides + (data.strides[-1],), writeable=False)
@@ -0,0 +1,243 @@
+"""
+Signal quality index and lead-off detection for ECG recordings
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import csv
+
+import numpy as np
+
+from recording import counts_to_millivolts
+
+# All thresholds below are in millivolts, the same unit ecg_read outputs
+# Fraction of full scale above which a sample counts as saturated
+SATURATION_LEVEL = 0.98
+# A window with a standard deviation below this is a flat line (loose electrode)
+FLAT_STD = 0.002
+# Noise is the share of signal power above this frequency (Hz)
+HF_CUTOFF = 40.0
+HF_LIMIT = 0.5
+# Mains hum within this many Hz of these frequencies isn't counted as noise,
+# the live windows are scored before ecg_read's notch filter would have removed it
+MAINS_FREQS = (50.0, 60.0)
+MAINS_WIDTH = 2.0
+# Largest allowed change in baseline across one window
+WANDER_LIMIT = 2.0
+
+METRICS = ('saturation', 'flat', 'hf_noise', 'wander')
+
+
+def _mains_bins(freqs):
+    # True for frequencies close to 50 Hz or 60 Hz mains
+    mains = np.zeros(len(freqs), dtype=bool)
+    for mains_freq in MAINS_FREQS:
+        mains |= np.abs(freqs - mains_freq) <= MAINS_WIDTH
+    return mains
+
+
+def window_quality(windows, sampling_freq, full_scale=None):
+    """
+    Calculates the quality metrics of windows of ECG data
+    :param windows: ECG data split into windows, shape (leads, windows, samples)
+    :type windows: ndarray
+    :param sampling_freq: Sampling frequency (Hz)
+    :type sampling_freq: float
+    :param full_scale: Largest voltage the ADC can output (mV), saturation is skipped if None
+    :type full_scale: float
+    :return: Saturated fraction, flat line, high-frequency noise ratio and baseline wander,
+             each of shape (windows, leads)
+    :rtype: ndarray, ndarray, ndarray, ndarray
+    """
+    windows = np.asarray(windows, dtype=float)
+    length = windows.shape[-1]
+    if full_scale is None:
+        saturation = np.zeros(windows.shape[:-1])
+    else:
+        saturation = np.mean(np.abs(windows) >= SATURATION_LEVEL * full_scale, axis=-1)
+    centred = windows - windows.mean(axis=-1, keepdims=True)
+    flat = centred.std(axis=-1) < FLAT_STD
+    # Share of power (excluding DC and mains hum) above the cutoff frequency
+    # Hann window keeps off-bin hum from leaking out of the mains band
+    power = np.abs(np.fft.rfft(centred * np.hanning(length), axis=-1)) ** 2
+    freqs = np.fft.rfftfreq(length, 1 / sampling_freq)
+    counted = (freqs > 0) & ~_mains_bins(freqs)
+    total = power[..., counted].sum(axis=-1)
+    high = power[..., counted & (freqs >= HF_CUTOFF)].sum(axis=-1)
+    hf_noise = np.divide(high, total, out=np.zeros_like(total), where=total > 0)
+    # Least squares slope of each window, scaled to the change across the window
+    t = np.arange(length) - (length - 1) / 2
+    slope = (centred * t).sum(axis=-1) / max((t ** 2).sum(), 1)
+    wander = np.abs(slope) * (length - 1)
+    return saturation.T, flat.T, hf_noise.T, wander.T
+
+
+class SignalQuality:
+    """
+    Per-window quality metrics of a recording
+    """
+    def __init__(self, window, sampling_freq, full_scale=None):
+        self.window = window
+        self.sampling_freq = sampling_freq
+        self.full_scale = full_scale
+        self.metrics = {metric: [] for metric in METRICS}
+
+    def __len__(self):
+        return len(self.metrics['saturation'])
+
+    def append(self, saturation, flat, hf_noise, wander):
+        """
+        Adds the metrics of one or more windows, each of shape (windows, leads)
+        """
+        for metric, values in zip(METRICS, (saturation, flat, hf_noise, wander)):
+            self.metrics[metric].extend(np.atleast_2d(values))
+
+    def values(self, metric):
+        """
+        :return: Metric of each window and lead
+        :rtype: ndarray
+        """
+        return np.array(self.metrics[metric], dtype=float)
+
+    @property
+    def good(self):
+        """
+        :return: Boolean per window, True if every lead is usable
+        :rtype: ndarray
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=bool)
+        bad = ((self.values('saturation') > 0) | (self.values('flat') > 0)
+               | (self.values('hf_noise') > HF_LIMIT) | (self.values('wander') > WANDER_LIMIT))
+        return ~bad.any(axis=1)
+
+    def sample_mask(self, length):
+        """
+        Expands the window flags to one flag per sample
+        Samples after the last complete window are treated as good
+        :param length: Amount of samples in the recording
+        :type length: int
+        :return: Boolean per sample, True if usable
+        :rtype: ndarray
+        """
+        mask = np.ones(length, dtype=bool)
+        index = (np.arange(length) // self.window).astype(int)
+        inside = index < len(self)
+        mask[inside] = self.good[index[inside]]
+        return mask
+
+    def rescale(self, factor, sampling_freq=None):
+        """
+        Updates the window length after the recording has been resampled
+        :param factor: New sampling rate divided by the old one
+        :type factor: float
+        :param sampling_freq: New sampling rate (Hz), needed when sampling_freq was only the nominal rate
+                              the recording was measured against, defaults to scaling it by factor
+        :type sampling_freq: float
+        """
+        self.window = self.window * factor
+        self.sampling_freq = self.sampling_freq * factor if sampling_freq is None else sampling_freq
+
+
+class QualityMonitor(SignalQuality):
+    """
+    Computes the signal quality of each completed window while ecg_read is sampling
+    """
+    def __init__(self, window, sampling_freq, adc_max, leads=3):
+        # Saturation is checked against the largest voltage the ADC can output
+        super().__init__(window, sampling_freq, counts_to_millivolts(adc_max, adc_max))
+        self.adc_max = adc_max
+        self.leads = leads
+
+    def update(self, counts, count):
+        """
+        Listener for ecg_read, called after every sample
+        :param counts: Sampling buffer of ADC counts
+        :type counts: ndarray
+        :param count: Amount of samples received so far
+        :type count: int
+        """
+        if count % self.window != 0:
+            return
+        window = counts_to_millivolts(counts[:self.leads, count - self.window:count], self.adc_max)
+        self.append(*window_quality(window[:, np.newaxis, :], self.sampling_freq, self.full_scale))
+
+
+def signal_quality(waveforms, sampling_freq, window_time=1.0, full_scale=None):
+    """
+    Calculates the signal quality of a whole recording
+    :param waveforms: ECG data, one row per lead (mV)
+    :type waveforms: ndarray
+    :param sampling_freq: Sampling frequency (Hz)
+    :type sampling_freq: float
+    :param window_time: Window length (seconds)
+    :type window_time: float
+    :param full_scale: Largest voltage the ADC can output (mV)
+    :type full_scale: float
+    :return: Signal quality of each window
+    :rtype: SignalQuality
+    """
+    waveforms = np.atleast_2d(np.asarray(waveforms, dtype=float))
+    window = max(int(round(window_time * sampling_freq)), 1)
+    count = waveforms.shape[1] // window
+    quality = SignalQuality(window, sampling_freq, full_scale)
+    if count > 0:
+        windows = waveforms[:, :count * window].reshape(waveforms.shape[0], count, window)
+        quality.append(*window_quality(windows, sampling_freq, full_scale))
+    return quality
+
+
+def save_quality(name, quality):
+    """
+    Saves signal quality to csv, one row per window
+    :param name: File name for csv (include .csv)
+    :type name: string
+    :param quality: Signal quality
+    :type quality: SignalQuality
+    """
+    values = [quality.values(metric) for metric in METRICS]
+    leads = values[0].shape[1] if len(quality) else 0
+    with open(name, 'wt', newline='') as csv_object:
+        csv_writer = csv.writer(csv_object, delimiter=',')
+        csv_writer.writerow(['window', quality.window, 'sampling_rate', quality.sampling_freq,
+                             'full_scale', quality.full_scale])
+        csv_writer.writerow(['good'] + ["%s %d" % (metric, lead) for metric in METRICS for lead in range(leads)])
+        for i, good in enumerate(quality.good):
+            row = [int(good)]
+            for metric in values:
+                row.extend(metric[i])
+            csv_writer.writerow(row)
+
+
+def load_quality(name):
+    """
+    Loads signal quality saved by save_quality
+    :param name: File name of csv
+    :type name: string
+    :return: Signal quality
+    :rtype: SignalQuality
+    """
+    with open(name, newline='') as csv_object:
+        rows = list(csv.reader(csv_object, delimiter=','))
+    settings = rows[0]
+    full_scale = None if settings[5] in ('', 'None') else float(settings[5])
+    quality = SignalQuality(float(settings[1]), float(settings[3]), full_scale)
+    if len(rows) > 2:
+        data = np.array(rows[2:], dtype=float)[:, 1:]
+        quality.append(*np.split(data, len(METRICS), axis=1))
+    return quality
@@ -0,0 +1,144 @@
+"""
+Compact in-memory ECG recording, storing raw ADC counts and deriving the leads when needed
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from functools import cached_property
+
+import numpy as np
+from scipy import signal
+
+from chunked import chunked_filtfilt
+
+
+def counts_to_millivolts(counts, adc_max):
+    """
+    Converts raw ADC counts to millivolts, the same calculation as adc_voltage
+    :param counts: ADC output
+    :type counts: ndarray
+    :param adc_max: This value is from the lookup table
+    :type adc_max: int
+    :return: Voltage (mV)
+    :rtype: ndarray
+    """
+    # Equation from the ADS1293 datasheet (page 36 or 8.4.3): https://www.ti.com/lit/gpn/ads1293
+    return (np.asarray(counts, dtype=float) / adc_max - 1 / 2) * 4.8 / 3.5 * pow(10, 3)
+
+
+def _augmented(lead_i, lead_ii):
+    # aVR, aVL = (I - III) / 2 and aVF = (II + III) / 2, with III = II - I
+    return -(lead_i + lead_ii) / 2, lead_i - lead_ii / 2, lead_ii - lead_i / 2
+
+
+class Recording:
+    """
+    ECG recording holding only the three measured leads as int32 ADC counts, a quarter of
+    the memory of six float64 leads.
+    The measured leads in millivolts (baseline removed, mains notch filtered) are worked out
+    the first time they are used and then cached as float32, bringing the recording up to half
+    the memory of six float64 leads until clear_cache is called. float32 keeps well below a
+    microvolt of precision over the ADC's range.
+    The augmented leads are worked out from them on each use as they are just sums of Lead I
+    and Lead II. Leads are handed out as float64, like the waveform array used to be.
+    Indexing and numpy conversion give the usual six leads, so it can be used wherever the
+    6 x samples waveform array was used before.
+    """
+    def __init__(self, counts, adc_max, sampling_rate, notch_freq=50.0, quality_factor=30.0):
+        """
+        :param counts: Lead I, II and III ADC counts, shape (3, samples)
+        :type counts: ndarray
+        :param adc_max: ADCMAX from the lookup table
+        :type adc_max: int
+        :param sampling_rate: Sampling rate (Hz)
+        :type sampling_rate: float
+        :param notch_freq: Mains frequency removed by the notch filter (50 Hz or 60 Hz)
+        :type notch_freq: float
+        :param quality_factor: Quality factor of notch filter
+        :type quality_factor: float
+        """
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.adc_max = adc_max
+        self.sampling_rate = sampling_rate
+        self.notch_freq = notch_freq
+        self.quality_factor = quality_factor
+
+    @property
+    def shape(self):
+        return 6, self.counts.shape[1]
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.lead(index)
+        if isinstance(index, tuple) and len(index) == 2:
+            # Only the samples asked for are worked out, e.g. recording[:, start:end]
+            return self._leads(index[1])[index[0]]
+        return np.asarray(self)[index]
+
+    def __array__(self, dtype=None, copy=None):
+        waveforms = self._leads(slice(None))
+        return waveforms if dtype is None else waveforms.astype(dtype)
+
+    def _leads(self, samples):
+        # All six leads over the given samples
+        measured = self.measured[:, samples].astype(float)
+        return np.stack([*measured, *_augmented(measured[0], measured[1])])
+
+    @cached_property
+    def measured(self):
+        """
+        :return: Lead I, II and III in millivolts with baseline removed and notch filter applied (float32)
+        :rtype: ndarray
+        """
+        leads = counts_to_millivolts(self.counts, self.adc_max)
+        leads -= leads.mean(axis=1, keepdims=True)
+        if leads.shape[1] > 0:
+            b_notch, a_notch = signal.iirnotch(self.notch_freq, self.quality_factor, self.sampling_rate)
+            leads = chunked_filtfilt(b_notch, a_notch, leads)
+        return leads.astype(np.float32)
+
+    def lead(self, index):
+        """
+        :param index: Lead number, in the order Lead I, Lead II, Lead III, aVR, aVL, aVF
+        :type index: int
+        :return: Lead in millivolts
+        :rtype: ndarray
+        """
+        if not -6 <= index < 6:
+            raise IndexError("Lead index out of range")
+        if index < 0:
+            index += 6
+        if index < 3:
+            return self.measured[index].astype(float)
+        return _augmented(self.measured[0].astype(float), self.measured[1].astype(float))[index - 3]
+
+    def augmented(self):
+        """
+        :return: aVR, aVL and aVF in millivolts
+        :rtype: ndarray
+        """
+        return np.stack(_augmented(self.measured[0].astype(float), self.measured[1].astype(float)))
+
+    def clear_cache(self):
+        """
+        Frees the derived leads, they are worked out again when next used
+        """
+        self.__dict__.pop('measured', None)
@@ -0,0 +1,144 @@
+"""
+Streaming arbitrary-ratio resampler, used to bring recordings to a fixed integer sampling rate
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+from fractions import Fraction
+
+import numpy as np
+from scipy import signal
+
+# Input samples per call to process when resampling a whole recording, keeps the temporary arrays small
+CHUNK_SIZE = 1 << 16
+
+
+class StreamingResampler:
+    """
+    Resamples data chunk by chunk to any rate, the exact ratio fs_out / fs_in is used rather
+    than a rational approximation, so even drifts of a fraction of a Hz are corrected.
+    Each output sample is worked out from a lowpass kernel stored at `oversampling` points per
+    input sample, linearly interpolated to the output's exact position between input samples
+    (a polyphase filter with interpolated coefficients, the same idea as a Farrow structure).
+    The filter state is kept between chunks, so feeding a recording in pieces gives the same
+    output as feeding it all at once.
+    Output sample m is the input at time m / fs_out, it is returned once the input reaches
+    `delay` samples past that time.
+    Equal rates are passed straight through.
+    """
+    def __init__(self, fs_in, fs_out, leads=1, taps_per_phase=16, oversampling=256):
+        """
+        :param fs_in: Input sampling rate (Hz), e.g. the measured rate from ecg_read
+        :type fs_in: float
+        :param fs_out: Output sampling rate (Hz)
+        :type fs_out: float
+        :param leads: Amount of leads in each chunk
+        :type leads: int
+        :param taps_per_phase: Filter taps per output sample when upsampling, more gives a sharper cutoff.
+                               Scaled up by the downsampling factor when downsampling
+        :type taps_per_phase: int
+        :param oversampling: Kernel points stored per input sample
+        :type oversampling: int
+        """
+        self.fs_out = fs_out
+        self.passthrough = fs_in == fs_out
+        # Input samples per output sample
+        self.step = fs_in / fs_out
+        # Cutoff below the lower of the two Nyquist frequencies, relative to the input's
+        scale = min(1.0, fs_out / fs_in)
+        self.taps = max(int(math.ceil(taps_per_phase / scale)), 2)
+        self.oversampling = oversampling
+        h = signal.firwin(self.taps * oversampling, scale / oversampling, window=('kaiser', 5.0))
+        # Gain of oversampling as only every oversampling-th point lands on an input sample,
+        # the extra zero lets the last point be interpolated
+        self.kernel = np.append(h * oversampling, 0.0)
+        # Centre of the kernel (input samples)
+        self.delay = (len(h) - 1) / 2 / oversampling
+        self.history = np.zeros((leads, self.taps - 1))
+        # Amount of input received and index of the next output sample
+        self.count = 0
+        self.next_out = 0
+
+    def process(self, chunk):
+        """
+        Resamples the next chunk of data
+        :param chunk: Data of shape (leads, samples)
+        :type chunk: ndarray
+        :return: Every output sample that can be computed so far, shape (leads, samples)
+        :rtype: ndarray
+        """
+        chunk = np.asarray(chunk, dtype=float).reshape(self.history.shape[0], -1)
+        if self.passthrough:
+            self.count += chunk.shape[1]
+            self.next_out = self.count
+            return chunk
+        buffer = np.concatenate((self.history, chunk), axis=1)
+        total = self.count + chunk.shape[1]
+        # Output m is centred on input position m * step, so needs input up to m * step + delay
+        end = max(int(math.ceil((total - self.delay) / self.step)) + 1, self.next_out)
+        position = np.arange(self.next_out, end, dtype=np.int64) * self.step + self.delay
+        newest = np.floor(position).astype(np.int64)
+        # Rounding can put the last one just past the input received
+        position, newest = position[newest < total], newest[newest < total]
+        fraction = position - newest
+        # The buffer starts at input index count - (taps - 1)
+        index = newest - self.count + self.taps - 1
+        result = np.zeros((buffer.shape[0], len(position)))
+        for tap in range(self.taps):
+            point = (tap + fraction) * self.oversampling
+            low = point.astype(np.int64)
+            weight = point - low
+            coefficient = self.kernel[low] + weight * (self.kernel[low + 1] - self.kernel[low])
+            result += buffer[:, index - tap] * coefficient
+        self.history = buffer[:, buffer.shape[1] - (self.taps - 1):]
+        self.count = total
+        self.next_out += len(position)
+        return result
+
+    def flush(self):
+        """
+        Pushes zeros through the filter to get the output still held back by the delay
+        :return: Remaining output samples
+        :rtype: ndarray
+        """
+        if self.passthrough:
+            return np.zeros((self.history.shape[0], 0))
+        return self.process(np.zeros((self.history.shape[0], int(math.ceil(self.delay)) + 1)))
+
+
+def resample_recording(waveforms, fs_in, fs_out):
+    """
+    Resamples a whole recording to a fixed rate, the output starts at the same time as the input
+    :param waveforms: ECG data, one row per lead
+    :type waveforms: ndarray
+    :param fs_in: Sampling rate of the recording (Hz)
+    :type fs_in: float
+    :param fs_out: Requested sampling rate (Hz)
+    :type fs_out: int
+    :return: Resampled data and its sampling rate
+    :rtype: ndarray, float
+    """
+    waveforms = np.atleast_2d(np.asarray(waveforms, dtype=float))
+    samples = waveforms.shape[1]
+    resampler = StreamingResampler(fs_in, fs_out, leads=waveforms.shape[0])
+    pieces = [resampler.process(waveforms[:, i:i + CHUNK_SIZE]) for i in range(0, samples, CHUNK_SIZE)]
+    data = np.concatenate(pieces + [resampler.flush()], axis=1)
+    # Same length as resample_poly gives, worked out exactly so e.g. 533 -> 533 Hz keeps every sample
+    length = math.ceil(samples * Fraction(fs_out) / Fraction(fs_in))
+    return data[:, :length], fs_out
@@ -0,0 +1,262 @@
+"""
+Local network streaming of live ECG data to multiple clients
+
+Copyright 2020 OskarCodes
+
+This file is part of Systolic
+
+Systolic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Systolic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Systolic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import queue
+import socket
+import struct
+import threading
+
+import numpy as np
+
+# Each block is this header followed by leads * samples little-endian float32, one lead after another
+# magic, block number, index of first sample, sampling rate, leads, samples
+HEADER = struct.Struct('<4sIQfHI')
+MAGIC = b'SYSB'
+
+
+def pack_block(seq, start, sampling_freq, data):
+    """
+    Packs a block of samples for sending
+    :param seq: Block number
+    :type seq: int
+    :param start: Index of the first sample in the recording
+    :type start: int
+    :param sampling_freq: Sampling frequency (Hz)
+    :type sampling_freq: float
+    :param data: Samples, shape (leads, samples)
+    :type data: ndarray
+    :return: Packed block
+    :rtype: bytes
+    """
+    data = np.ascontiguousarray(data, dtype='<f4')
+    return HEADER.pack(MAGIC, seq, start, sampling_freq, data.shape[0], data.shape[1]) + data.tobytes()
+
+
+class _Client:
+    def __init__(self, connection, queue_size):
+        self.connection = connection
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.thread = None
+
+
+class StreamServer:
+    """
+    Broadcasts blocks of samples over TCP. Every client has its own bounded queue and sender
+    thread, so a slow client has blocks dropped rather than holding up sampling or other clients.
+    Works as an ecg_read listener, sending the measured leads every block_size samples,
+    passed through convert first if set (e.g. ADC counts to millivolts).
+    """
+    def __init__(self, host='127.0.0.1', port=0, block_size=64, queue_size=32, sampling_freq=0.0, leads=3,
+                 convert=None):
+        self.block_size = block_size
+        self.convert = convert
+        self.queue_size = queue_size
+        self.sampling_freq = sampling_freq
+        self.leads = leads
+        self.clients = []
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.sent = 0
+        # Latest ecg_read buffer, kept so flush can send the samples after the last complete block
+        self.buffer = None
+        self.count = 0
+        self.running = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen()
+        # Port actually used, useful when port 0 picks a free one
+        self.address = self.socket.getsockname()
+        self.accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self.accept_thread.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                break
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(connection, self.queue_size)
+            client.thread = threading.Thread(target=self._send, args=(client,), daemon=True)
+            with self.lock:
+                self.clients.append(client)
+            client.thread.start()
+
+    def _send(self, client):
+        while True:
+            block = client.queue.get()
+            if block is None:
+                break
+            try:
+                client.connection.sendall(block)
+            except OSError:
+                break
+        self._remove(client)
+
+    def _remove(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.connection.close()
+
+    def broadcast(self, data, start=None):
+        """
+        Queues a block of samples for every connected client, never blocks
+        :param data: Samples, shape (leads, samples)
+        :type data: ndarray
+        :param start: Index of the first sample, defaults to following on from the last block
+        :type start: int
+        """
+        if start is None:
+            start = self.sent
+        block = pack_block(self.seq, start, self.sampling_freq, data)
+        self.seq += 1
+        self.sent = start + data.shape[1]
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.queue.put_nowait(block)
+            except queue.Full:
+                client.dropped += 1
+
+    def update(self, counts, count):
+        """
+        Listener for ecg_read, sends the measured leads once a block is complete
+        """
+        self.buffer = counts
+        self.count = count
+        if count - self.sent >= self.block_size:
+            self._send_received()
+
+    def _send_received(self):
+        block = self.buffer[:self.leads, self.sent:self.count]
+        if self.convert is not None:
+            block = self.convert(block)
+        self.broadcast(block, self.sent)
+
+    def flush(self):
+        """
+        Sends the samples after the last complete block, to be called once ecg_read returns
+        """
+        if self.buffer is not None and self.count > self.sent:
+            self._send_received()
+
+    def reset(self, sampling_freq=None, convert=None):
+        """
+        Starts numbering samples from zero again, for a new recording
+        """
+        self.sent = 0
+        self.buffer = None
+        self.count = 0
+        if sampling_freq is not None:
+            self.sampling_freq = sampling_freq
+        if convert is not None:
+            self.convert = convert
+
+    def close(self):
+        """
+        Stops accepting clients and disconnects the connected ones
+        """
+        self.running = False
+        try:
+            # Wakes up the accept thread
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            self._disconnect(client)
+
+    @staticmethod
+    def _disconnect(client):
+        # Make room for the stop signal if the queue is full
+        while True:
+            try:
+                client.queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    client.queue.get_nowait()
+                except queue.Empty:
+                    pass
+        client.thread.join(timeout=1)
+        if client.thread.is_alive():
+            # Stuck sending to a client that stopped reading
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class StreamClient:
+    """
+    Reference client for StreamServer
+    """
+    def __init__(self, host='127.0.0.1', port=0, timeout=None):
+        self.connection = socket.create_connection((host, port), timeout=timeout)
+
+    def _receive(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError("Server closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def read_block(self):
+        """
+        Receives the next block
+        :return: Block number, index of first sample, sampling rate and samples (leads, samples)
+        :rtype: int, int, float, ndarray
+        """
+        magic, seq, start, sampling_freq, leads, samples = HEADER.unpack(self._receive(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Bad block header")
+        data = np.frombuffer(self._receive(leads * samples * 4), dtype='<f4').reshape(leads, samples)
+        return seq, start, sampling_freq, data
+
+    def blocks(self):
+        """
+        Yields blocks until the server disconnects
+        """
+        while True:
+            try:
+                yield self.read_block()
+            except EOFError:
+                return
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    # Prints each block received from a server, e.g. python streaming.py 5000
+    import sys
+    client = StreamClient(port=int(sys.argv[1]))
+    for seq, start, sampling_freq, data in client.blocks():
+        print("Block %d: samples %d-%d at %.1f Hz, mean %s"
+              % (seq, start, start + data.shape[1], sampling_freq, data.mean(axis=1)))
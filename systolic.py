@@ -23,9 +23,10 @@ import sys
 import time
 
 import csv
+from concurrent.futures import CancelledError
 from configparser import ConfigParser, NoOptionError, NoSectionError
 
-from PyQt5 import QtWidgets, uic
+from PyQt5 import QtCore, QtWidgets, uic
 from PyQt5.QtWidgets import QMessageBox
 
 import matplotlib.pyplot as plt
@@ -39,11 +40,21 @@ from tqdm import tqdm
 
 from scipy import signal
 
+from analysis import AnalysisCancelled, AnalysisGraph
+from capture import CaptureSerial
+from chunked import chunked_sosfilt
+from edf import BASELINE_RANGE, EDFWriter, adc_range
 from mathtools import mean_downscaler
+from quality import QualityMonitor, load_quality, save_quality
+from recording import Recording, counts_to_millivolts
+from resample import resample_recording
+from streaming import StreamServer
 
 # These are the two files for if the ADS1293's SDM is running at 204.8 kHz or at 102.4 kHz
 # CSV_FILE = 'csv/sampling_1024.csv' # 102.4 kHz
 CSV_FILE = 'csv/sampling_2048.csv'  # 204.8 kHz
+# Samples written to csv at a time by save_data
+SAVE_CHUNK = 1 << 14
 
 CONFIG_REG = "0x00"
 R2_REG = "0x21"
@@ -74,13 +85,114 @@ def __butter_filter(order, critical_freq, filter_type, sampling_freq, data):
     """
     # Create butter filter with sos output
     sos = signal.butter(order, critical_freq, btype=filter_type, output='sos', fs=sampling_freq)
-    # Apply sos parameters to input data
-    f_data = signal.sosfilt(sos, data)
+    # Apply sos parameters to input data, long recordings are split over several threads
+    f_data = chunked_sosfilt(sos, data)
     # Return filtered data
     return f_data
 
 
-def pan_tompkins(waveform, sampling_freq, order=2, plot=False):
+def pan_tompkins_filter(waveform, sampling_freq, order=2):
+    """
+    First step of Pan–Tompkins, bandpass filters Lead II from 5-15 Hz
+    :param waveform: Waveform data, Lead II is used
+    :type waveform: ndarray
+    :param sampling_freq: Sampling Frequency (Hz)
+    :type sampling_freq: float
+    :param order: Order of notch filter applied from 5-15 Hz
+    :type order: int
+    :return: Filtered Lead II
+    :rtype: ndarray
+    """
+    low = 5
+    high = 15
+    return __butter_filter(order, [low, high], 'bandpass', sampling_freq, waveform[1])
+
+
+def pan_tompkins_envelope(filtered, sampling_freq, average_window=0.15):
+    """
+    Derivative, squaring and moving average steps of Pan–Tompkins
+    :param filtered: Bandpass filtered lead
+    :type filtered: ndarray
+    :param sampling_freq: Sampling Frequency (Hz)
+    :type sampling_freq: float
+    :param average_window: Moving average window (seconds)
+    :type average_window: float
+    :return: Integrated envelope, one point per moving average window
+    :rtype: ndarray
+    """
+    # Derivative filter
+    envelope = np.gradient(filtered)
+    # Square signal
+    envelope = envelope ** 2
+    # Calculate moving average
+    sample_amount = int(average_window * sampling_freq)
+    return np.array(mean_downscaler(envelope, sample_amount))
+
+
+def pan_tompkins_beats(envelope, sampling_freq, average_window=0.15, mask=None):
+    """
+    Finds beats in the integrated envelope
+    :param envelope: Integrated envelope from pan_tompkins_envelope
+    :type envelope: ndarray
+    :param sampling_freq: Sampling Frequency (Hz)
+    :type sampling_freq: float
+    :param average_window: Moving average window used for the envelope (seconds)
+    :type average_window: float
+    :param mask: Boolean per sample, beats in False samples are skipped
+    :type mask: ndarray
+    :return: Index of each beat in the envelope
+    :rtype: ndarray
+    """
+    # If point in moving average is greater than 0.002, then it is a beat.
+    # Right now I've gone the lazy way of just using a constant value to count as a beat,
+    # but in future I will do it properly like discussed in the article I linked before.
+    sample_amount = int(average_window * sampling_freq)
+    # Each envelope point is only usable if all of its samples are
+    block_mask = np.ones(len(envelope) * sample_amount, dtype=bool)
+    if mask is not None:
+        block_mask[:len(mask)] = mask
+    block_mask = block_mask.reshape(len(envelope), sample_amount).all(axis=1)
+    # A beat is a local peak above the constant threshold, the last point can't be checked
+    value = envelope[:-1]
+    peaks = (value > 0.002) & (envelope[1:] <= value) & block_mask[:-1]
+    return np.flatnonzero(peaks)
+
+
+def pan_tompkins_rate(beats, waveform, sampling_freq, mask=None):
+    """
+    Heart rate from the beats found over the usable part of the recording
+    :param beats: Beats from pan_tompkins_beats
+    :type beats: ndarray
+    :param waveform: Waveform data
+    :type waveform: ndarray
+    :param sampling_freq: Sampling Frequency (Hz)
+    :type sampling_freq: float
+    :param mask: Boolean per sample, only True samples count towards the sampling time
+    :type mask: ndarray
+    :return: Heart rate
+    :rtype: int
+    """
+    # Only the length is needed, np.shape doesn't work out the leads of a Recording
+    good_samples = np.shape(waveform)[1] if mask is None else np.count_nonzero(mask)
+    if good_samples == 0:
+        return 0
+    sample_time = good_samples / sampling_freq
+    return round(len(beats) / sample_time * 60)
+
+
+def plot_beats(envelope, beats):
+    """
+    Plots the integrated envelope with the beats marked
+    """
+    # Below is work in progress
+    # x_beats_on_normal = np.argsort(waveform)[::-1][:beats]
+    # y_beats_on_normal = list(map(lambda x: waveform[x], x_beats_on_normal))
+    plt.figure()
+    plt.plot(envelope)
+    plt.scatter(beats, envelope[beats], c='red', marker='x')
+
+
+def pan_tompkins(waveform, sampling_freq, order=2, plot=False, mask=None):
     """
     :param plot: Should a graph of the filtered ECG data be produced?
     :type plot: bool
@@ -90,62 +202,57 @@ def pan_tompkins(waveform, sampling_freq, order=2, plot=False):
     :type sampling_freq: float
     :param order: Order of notch filter applied from 5-15 Hz
     :type order: int
+    :param mask: Boolean per sample, beats in False samples are skipped (see SignalQuality.sample_mask)
+    :type mask: ndarray
     :return: Heart rate
     :rtype: int
     """
     # Here I attempt to implement the Pan–Tompkins algorithm, as shown in:
     # https://en.wikipedia.org/wiki/Pan%E2%80%93Tompkins_algorithm
     # It is not complete as of now, e.g. there is no threshold calculation as of now
-    # Use Lead II
-    waveform = waveform[1]
-    # Calculate sampling time
-    sample_time = len(waveform) / sampling_freq
-    # Firstly 5-15 Hz bandpass is applied
-    low = 5
-    high = 15
-    waveform_filt = __butter_filter(order, [low, high], 'bandpass', sampling_freq, waveform)
-    # Derivative filter
-    waveform_filt = np.gradient(waveform_filt)
-    # Square signal
-    waveform_filt = waveform_filt ** 2
-    # Calculate moving average
-    average_window = 0.15  # seconds
-    sample_amount = int(average_window * sampling_freq)
-    waveform_filt = mean_downscaler(waveform_filt, sample_amount)
-    """
-    If point in moving average is greater than 0.4, then it is a beat.
-    Wait refractory period (approximately) Right now I've gone the lazy way
-    of just using a constant value to count as a beat, but in future I
-    will do it properly like discussed in the  article I linked before.
-    """
-    beats = 0
-    refractory = 0
-    # For plotting peak graph
-    x_vals = []
-    y_vals = []
-    for i, value in enumerate(waveform_filt):
-        if (i + 1) >= len(waveform_filt):
-            break
-        if value > 0 and waveform_filt[i + 1] <= value and value > 0.002:
-            x_vals.append(i)
-            y_vals.append(value)
-            beats += 1
-            refractory = i
-        # I can't exactly wait 200 ms, so I have to just skip 1
-        if i == (refractory + 1):
-            continue
-    heart_rate = round(beats / sample_time * 60)
+    filtered = pan_tompkins_filter(waveform, sampling_freq, order)
+    envelope = pan_tompkins_envelope(filtered, sampling_freq)
+    beats = pan_tompkins_beats(envelope, sampling_freq, mask=mask)
+    heart_rate = pan_tompkins_rate(beats, waveform, sampling_freq, mask)
     if plot:
-        # Below is work in progress
-        # x_beats_on_normal = np.argsort(waveform)[::-1][:beats]
-        # y_beats_on_normal = list(map(lambda x: waveform[x], x_beats_on_normal))
-        plt.plot(waveform_filt)
-        plt.scatter(x_vals, y_vals, c='red', marker='x')
+        plot_beats(envelope, beats)
         plt.show()
     return heart_rate
 
 
-def save_data(name, headers, data, sampling_rate):
+def analysis_graph(workers=2):
+    """
+    Builds the analysis graph used by the ECG Window, the steps of pan_tompkins as cached nodes
+    Inputs are waveform, sampling_freq and mask, parameters are order and average_window
+    :param workers: Amount of worker threads
+    :type workers: int
+    :return: Analysis graph
+    :rtype: AnalysisGraph
+    """
+    graph = AnalysisGraph(workers)
+    graph.add('filtered', pan_tompkins_filter, params=('order',), inputs=('waveform', 'sampling_freq'))
+    graph.add('envelope', pan_tompkins_envelope, deps=('filtered',), params=('average_window',),
+              inputs=('sampling_freq',))
+    graph.add('beats', pan_tompkins_beats, deps=('envelope',), params=('average_window',),
+              inputs=('sampling_freq', 'mask'))
+    graph.add('heart_rate', pan_tompkins_rate, deps=('beats',), inputs=('waveform', 'sampling_freq', 'mask'))
+    return graph
+
+
+def quality_name(name):
+    """
+    File name the signal quality of a recording is stored under
+    :param name: File name of the recording csv
+    :type name: string
+    :return: File name of the signal quality csv
+    :rtype: string
+    """
+    if name.endswith('.csv'):
+        name = name[:-len('.csv')]
+    return name + '_quality.csv'
+
+
+def save_data(name, headers, data, sampling_rate, quality=None):
     """
     Saves ECG data to csv
     :param name: File name for csv (include .csv)
@@ -156,9 +263,13 @@ def save_data(name, headers, data, sampling_rate):
     :type data: array
     :param sampling_rate: Sampling rate
     :type sampling_rate: float
+    :param quality: Signal quality, saved alongside the data if given
+    :type quality: SignalQuality
     """
     if data is None:
         return
+    if quality is not None:
+        save_quality(quality_name(name), quality)
     with open(name, 'wt', newline='') as csv_object:
         csv_writer = csv.writer(csv_object, delimiter=',')
         # Settings header
@@ -166,19 +277,12 @@ def save_data(name, headers, data, sampling_rate):
         # Data headers
         csv_writer.writerow(settings)
         csv_writer.writerow(headers)  # write header
-        cols_indices = np.arange(len(data[0]))
-        rows_indices = np.arange(len(data))
-        row_data = []
-        """
-        I know this is overcomplicating a simple task of iterating over 6 rows, however
-        I wanted to do it this way just incase in future I wanted to call this function
-        with just three rows of data. It wouldn't be fun if  the function didn't work then!
-        """
-        for column_index in cols_indices:
-            for row_index in rows_indices:
-                row_data.append(data[row_index][column_index])
-            csv_writer.writerow(row_data)
-            row_data = []
+        # One row per sample, works for any amount of leads (e.g. a Recording or just three rows).
+        # Written a chunk at a time so only a chunk is ever held as floats
+        if not hasattr(data, 'shape'):
+            data = np.asarray(data)
+        for start in range(0, data.shape[1], SAVE_CHUNK):
+            csv_writer.writerows(np.asarray(data[:, start:start + SAVE_CHUNK]).T.tolist())
 
 
 def bin_to_hex(binary_in):
@@ -382,7 +486,24 @@ def adc_voltage(raw_data, adc_max=0x800000):
     return raw_data
 
 
-def ecg_read(adc_max, ser, data_limit):
+def adc_count(raw_data, adc_max=0x800000):
+    """
+    Function returns the received digital value as an integer
+    :param raw_data: digital output
+    :type raw_data: string
+    :param adc_max: This value is from the lookup table
+    :type adc_max: int
+    :return: ADC count, mid-scale (0 V) if it can't be read
+    :rtype: int
+    """
+    try:
+        return int(float(raw_data))
+    except ValueError:
+        # This often occurs with just the first piece of data, same as adc_voltage
+        return adc_max // 2
+
+
+def ecg_read(adc_max, ser, data_limit, listeners=()):
     """
     Reads data from ECG
     :param adc_max: Value used to calculate voltage from adc output
@@ -391,11 +512,16 @@ def ecg_read(adc_max, ser, data_limit):
     :type ser: serial
     :param data_limit: Amount of data to receive
     :type data_limit: integer
+    :param listeners: Objects whose update(counts, count) is called after every sample with the ADC
+                      counts received so far, e.g. QualityMonitor
+    :type listeners: sequence
+    :return: Recording and sampling rate
+    :rtype: Recording, float
     """
     data_limit = round(data_limit)
     run_enable = True
-    # Prepares array for reading
-    y_vals = np.empty([6, data_limit])
+    # Prepares array for reading, only the three measured leads are kept as raw ADC counts
+    counts = np.empty([3, data_limit], dtype=np.int32)
     # Sends sampling start command
     send_data(CONFIG_REG, bin_to_hex('00000001'), ser)
     # Need to consider if this sleep below is actually needed
@@ -415,16 +541,15 @@ def ecg_read(adc_max, ser, data_limit):
                 except Exception as what_went_wrong:
                     print(what_went_wrong)
                     break
-                data[0] = adc_voltage(data[0], adc_max)
-                data[1] = adc_voltage(data[1], adc_max)
-                data[2] = adc_voltage(data[2], adc_max)
-                y_vals[0][i] = data[0]
-                y_vals[1][i] = data[1]
-                y_vals[2][i] = data[2]
+                counts[0][i] = adc_count(data[0], adc_max)
+                counts[1][i] = adc_count(data[1], adc_max)
+                counts[2][i] = adc_count(data[2], adc_max)
                 break
+        for listener in listeners:
+            listener.update(counts, i + 1)
     end = time.time()
 
-    data_amount = len(y_vals[0])
+    data_amount = len(counts[0])
     delta_time = end - start
     sampling_rate = data_amount / delta_time
 
@@ -435,27 +560,6 @@ def ecg_read(adc_max, ser, data_limit):
 
     # Sends sampling stop command
     send_data(CONFIG_REG, bin_to_hex('00000000'), ser)
-    # Calculates average of each of the three basic leads
-    average_i = np.average(y_vals[0])
-    average_ii = np.average(y_vals[1])
-    average_iii = np.average(y_vals[2])
-    for i in range(0, data_limit):
-        # Subtracts average from each point in lead
-        y_vals[0][i] = (y_vals[0][i] - average_i) * pow(10, 3)
-        y_vals[1][i] = (y_vals[1][i] - average_ii) * pow(10, 3)
-        y_vals[2][i] = (y_vals[2][i] - average_iii) * pow(10, 3)
-        # Calculates augmented leads
-        y_vals[3][i] = -1 * (float(y_vals[0][i]) + float(y_vals[1][i])) / 2  # aVR
-        y_vals[4][i] = (float(y_vals[0][i]) - float(y_vals[1][i])) / 2  # aVL
-        y_vals[5][i] = (float(y_vals[1][i]) - float(y_vals[0][i])) / 2  # aVF
-    # Same process as before, although I wonder if I can condense both while loops into one
-    average_aVR = np.average(y_vals[3])
-    average_aVL = np.average(y_vals[4])
-    average_aVF = np.average(y_vals[5])
-    for i in range(0, data_limit):
-        y_vals[3][i] = y_vals[3][i] - average_aVR
-        y_vals[4][i] = y_vals[4][i] - average_aVL
-        y_vals[5][i] = y_vals[5][i] - average_aVF
 
     # Sampling frequency (Hz), set from calculated value
     samp_freq = sampling_rate
@@ -467,18 +571,8 @@ def ecg_read(adc_max, ser, data_limit):
     # Quality factor of notch filter, not really sure what this does...
     quality_factor = 30.0
 
-    #TODO: See if I can get sos output for iirnotch instead of b,a
-    b_notch, a_notch = signal.iirnotch(notch_freq, quality_factor, samp_freq)
-
-    # Notch filter applied to all 6 leads at previously set frequency
-    y_vals[0] = signal.filtfilt(b_notch, a_notch, y_vals[0])
-    y_vals[1] = signal.filtfilt(b_notch, a_notch, y_vals[1])
-    y_vals[2] = signal.filtfilt(b_notch, a_notch, y_vals[2])
-    y_vals[3] = signal.filtfilt(b_notch, a_notch, y_vals[3])
-    y_vals[4] = signal.filtfilt(b_notch, a_notch, y_vals[4])
-    y_vals[5] = signal.filtfilt(b_notch, a_notch, y_vals[5])
-
-    return y_vals, samp_freq
+    # Baseline removal, notch filter and the augmented leads are worked out by the recording when used
+    return Recording(counts, adc_max, samp_freq, notch_freq, quality_factor), samp_freq
 
 
 def view_data(waveforms, sampling_rate, title='ECG 6 Lead'):
@@ -492,7 +586,7 @@ def view_data(waveforms, sampling_rate, title='ECG 6 Lead'):
     :type title: string
     """
     # Uses the awesome ecg-plot library to display the waveforms
-    ecg_plot.plot(waveforms, sample_rate=sampling_rate, title=title, columns=2)
+    ecg_plot.plot(np.asarray(waveforms), sample_rate=sampling_rate, title=title, columns=2)
     ecg_plot.show()
 
 
@@ -517,6 +611,10 @@ def value_lookup(bandwidth):
 
 
 class _ECGWindow(QtWidgets.QMainWindow):
+    # Analysis runs on worker threads, these bring its progress and results back to the GUI thread
+    analysis_progress = QtCore.pyqtSignal(int, str, int, int)
+    analysis_done = QtCore.pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         uic.loadUi("mainwindow.ui", self)
@@ -539,12 +637,15 @@ class _ECGWindow(QtWidgets.QMainWindow):
         self.stopButton.clicked.connect(self.stop)
         self.saveButton.clicked.connect(lambda: save_data('sample.csv', self.headers,
                                                           self.waveforms,
-                                                          self.sampling_rate))
+                                                          self.sampling_rate,
+                                                          self.quality))
         self.viewButton.clicked.connect(lambda: view_data(self.waveforms, self.sampling_rate))
         self.loadButton.clicked.connect(self.load_data)
         self.analysisButton.clicked.connect(self.analysis)
         self.samplingline.textChanged.connect(self.update_var)
         self.samplingrline.currentTextChanged.connect(self.update_var)
+        self.analysis_progress.connect(self.show_progress)
+        self.analysis_done.connect(self.show_analysis)
 
         self.conn_state(0)
 
@@ -561,8 +662,17 @@ class _ECGWindow(QtWidgets.QMainWindow):
         self.waveforms = []
         self.sampling_rate = 0
         self.heart_rate = 0
+        self.quality = None
         self.headers = ['Lead I', 'Lead II', 'Lead III', 'aVR', 'aVL', 'aVF']
 
+        # ANALYSIS, RESULTS ARE CACHED PER RECORDING AND PARAMETERS
+        self.graph = analysis_graph()
+        self.analysis_job = None
+        # Numbers each analysis run, so progress of a cancelled run can be told apart
+        self.analysis_number = 0
+        self.recording_key = 0
+        self.analysis_params = {'order': 2, 'average_window': 0.15}
+
         # SAMPLING PARAMETERS - USER SET. BELOW ARE THE DEFAULTS
         self.bandwidth = 160
         self.time = "5"
@@ -578,6 +688,19 @@ class _ECGWindow(QtWidgets.QMainWindow):
 
         # MISCELLANEOUS PARAMETERS
         self.config_name = 'config.ini'
+        # Raw serial bytes are recorded here while sampling if set (config option 'capture')
+        self.capture_name = None
+        # Recordings are resampled to this integer rate (Hz) if set (config option 'resample')
+        self.resample_rate = None
+        # Live data is streamed to local clients on this port if set (config option 'stream_port')
+        self.stream_port = None
+        self.stream = None
+        # Measured leads are written to this EDF+ file while sampling if set (config option 'edf')
+        self.edf_name = None
+        # The EDF+ file stores +/- this many mV around each lead's starting offset (config option 'edf_range'),
+        # or the whole ADC range at a much coarser resolution if set (config option 'edf_full_range')
+        self.edf_range = BASELINE_RANGE
+        self.edf_full_range = False
 
         # SETS TAB TO CONNECTION PAGE, FOR IF THE UI FILE IS SAVED AS TO HAVE ANOTHER TAB AS DEFAULT
         self.Tabs.setCurrentIndex(2)
@@ -591,9 +714,58 @@ class _ECGWindow(QtWidgets.QMainWindow):
     def analysis(self):
         """
         Wrapper for analysis functions, only contains heart rate calculation currently.
+        Runs in the background, any analysis still running is cancelled.
+        """
+        if self.analysis_job is not None and not self.analysis_job.done():
+            self.analysis_job.cancel()
+        mask = None
+        if self.quality is not None:
+            mask = self.quality.sample_mask(np.shape(self.waveforms)[1])
+        inputs = {'waveform': self.waveforms, 'sampling_freq': self.sampling_rate, 'mask': mask}
+        self.heartrateLine.setText("Calculating...")
+        self.analysis_number += 1
+        number = self.analysis_number
+        job = self.graph.submit('heart_rate', self.recording_key, inputs, dict(self.analysis_params),
+                                progress=lambda *step: self.analysis_progress.emit(number, *step))
+        self.analysis_job = job
+        job.future.add_done_callback(lambda _: self.analysis_done.emit(job))
+
+    def show_progress(self, number, name, done, total):
+        """
+        Shows which analysis step has finished, ignoring runs that have since been replaced
+        """
+        if number != self.analysis_number or self.analysis_job is None:
+            return
+        self.heartrateLine.setText("Calculating (%d/%d: %s)" % (done, total, name))
+
+    def show_analysis(self, job):
+        """
+        Shows the heart rate and beat graph once the analysis job has finished
+        :param job: Finished analysis job
+        :type job: AnalysisJob
         """
-        self.heart_rate = pan_tompkins(self.waveforms, self.sampling_rate, plot=True)
+        if job is not self.analysis_job or job.cancelled():
+            return
+        try:
+            self.heart_rate = job.result()
+        except (AnalysisCancelled, CancelledError):
+            return
         self.heartrateLine.setText("%s bpm" % self.heart_rate)
+        # Both are cached by now, so this doesn't recompute anything
+        envelope = self.graph.compute('envelope', job.recording_key, job.inputs, job.params)
+        beats = self.graph.compute('beats', job.recording_key, job.inputs, job.params)
+        plot_beats(envelope, beats)
+        plt.show(block=False)
+
+    def new_recording(self):
+        """
+        Stops analysis of the previous recording and drops its cached results
+        """
+        if self.analysis_job is not None:
+            self.analysis_job.cancel()
+            self.analysis_job = None
+        self.graph.clear(self.recording_key)
+        self.recording_key += 1
 
     def load_data(self):
         """
@@ -614,8 +786,13 @@ class _ECGWindow(QtWidgets.QMainWindow):
                 row = list(map(float, row))
                 self.waveforms.append(row)
         self.waveforms = np.array(self.waveforms)
+        self.new_recording()
         # Transpose array as CSV data isn't in the preferred format
         self.waveforms = self.waveforms.T
+        try:
+            self.quality = load_quality(quality_name(path))
+        except FileNotFoundError:
+            self.quality = None
         print("Data read")
         self.viewButton.setEnabled(True)
         self.analysisButton.setEnabled(True)
@@ -644,6 +821,12 @@ class _ECGWindow(QtWidgets.QMainWindow):
             try:
                 self.bandwidth = self.config.get('main', 'bandwidth')
                 self.time = self.config.get('main', 'time')
+                self.capture_name = self.config.get('main', 'capture', fallback=None)
+                self.resample_rate = self.config.getint('main', 'resample', fallback=None)
+                self.stream_port = self.config.getint('main', 'stream_port', fallback=None)
+                self.edf_name = self.config.get('main', 'edf', fallback=None)
+                self.edf_range = self.config.getfloat('main', 'edf_range', fallback=BASELINE_RANGE)
+                self.edf_full_range = self.config.getboolean('main', 'edf_full_range', fallback=False)
             except NoSectionError:
                 self.init_config()
             except NoOptionError:
@@ -770,7 +953,41 @@ class _ECGWindow(QtWidgets.QMainWindow):
                 return
         print("ECG Measurement Init")
         self.upload()
-        self.waveforms, self.sampling_rate = ecg_read(int(self.adc_max, 16), self.ser, int(self.points))
+        adc_max = int(self.adc_max, 16)
+        # Quality is checked once per second of data
+        self.quality = QualityMonitor(int(self.odr), float(self.odr), adc_max)
+        listeners = [self.quality]
+        if self.stream_port is not None:
+            if self.stream is None:
+                self.stream = StreamServer(port=self.stream_port)
+            self.stream.reset(float(self.odr), lambda counts: counts_to_millivolts(counts, adc_max))
+            listeners.append(self.stream)
+        edf_writer = None
+        if self.edf_name is not None:
+            if self.edf_full_range:
+                edf_writer = EDFWriter(self.edf_name, self.headers[:3], float(self.odr), *adc_range(adc_max), adc_max)
+            else:
+                edf_writer = EDFWriter(self.edf_name, self.headers[:3], float(self.odr), -self.edf_range,
+                                       self.edf_range, adc_max, remove_baseline=True)
+            listeners.append(edf_writer)
+        if self.capture_name is None:
+            self.waveforms, self.sampling_rate = ecg_read(adc_max, self.ser, int(self.points), listeners)
+        else:
+            with CaptureSerial(self.ser, self.capture_name) as ser:
+                self.waveforms, self.sampling_rate = ecg_read(adc_max, ser, int(self.points), listeners)
+        if self.stream_port is not None:
+            # Clients get the last partial block too
+            self.stream.flush()
+        if edf_writer is not None:
+            # Record duration is corrected to the measured sampling rate
+            edf_writer.close(self.sampling_rate)
+        if self.resample_rate is not None:
+            # The monitor only knew the nominal rate, so the new one is given rather than scaled
+            self.quality.rescale(self.resample_rate / self.sampling_rate, self.resample_rate)
+            self.waveforms, self.sampling_rate = resample_recording(self.waveforms, self.sampling_rate,
+                                                                    self.resample_rate)
+        self.new_recording()
+        print("Good quality windows = %d/%d" % (np.count_nonzero(self.quality.good), len(self.quality)))
 
         self.viewButton.setEnabled(True)
         self.saveButton.setEnabled(True)
@@ -790,6 +1007,15 @@ class _ECGWindow(QtWidgets.QMainWindow):
         send_data(R3CH2_REG, self.R3, self.ser)
         send_data(R3CH3_REG, self.R3, self.ser)
 
+    def closeEvent(self, event):
+        """
+        Disconnects stream clients and frees the stream's port when the window is closed
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        super().closeEvent(event)
+
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+import pytest
+import analysis
+import systolic
+
+
+def recording():
+    fs = 500
+    t = np.arange(10 * fs) / fs
+    lead = 10 * sum(np.exp(-((t - beat) / 0.01) ** 2) for beat in np.arange(0.5, 10, 1))
+    return {'waveform': np.vstack([lead] * 6), 'sampling_freq': fs, 'mask': None}
+
+
+class TestClass:
+    def test_graph_matches_pan_tompkins(self):
+        graph = systolic.analysis_graph()
+        inputs = recording()
+        params = {'order': 2, 'average_window': 0.15}
+        rate = graph.submit('heart_rate', 0, inputs, params).result(timeout=10)
+        assert rate == systolic.pan_tompkins(inputs['waveform'], inputs['sampling_freq'])
+        graph.shutdown()
+
+    def test_only_changed_nodes_recompute(self):
+        calls = []
+        graph = analysis.AnalysisGraph()
+        graph.add('a', lambda x, scale: calls.append('a') or x * scale, params=('scale',), inputs=('x',))
+        graph.add('b', lambda a, offset: calls.append('b') or a + offset, deps=('a',), params=('offset',))
+        assert graph.compute('b', 'rec', {'x': 2}, {'scale': 3, 'offset': 1}) == 7
+        assert graph.compute('b', 'rec', {'x': 2}, {'scale': 3, 'offset': 1}) == 7
+        assert graph.compute('b', 'rec', {'x': 2}, {'scale': 3, 'offset': 5}) == 11
+        assert calls == ['a', 'b', 'b']
+        assert graph.cached('a', 'rec', {'scale': 3, 'offset': 0})
+        graph.clear('rec')
+        assert not graph.cached('a', 'rec', {'scale': 3})
+        graph.shutdown()
+
+    def test_cancel(self):
+        started = threading.Event()
+        release = threading.Event()
+        graph = analysis.AnalysisGraph(workers=1)
+        graph.add('slow', lambda: started.set() or release.wait(5))
+        graph.add('after', lambda slow: 1, deps=('slow',))
+        progress = []
+        job = graph.submit('after', 0, {}, {}, progress=lambda *step: progress.append(step))
+        started.wait(5)
+        job.cancel()
+        release.set()
+        with pytest.raises(analysis.AnalysisCancelled):
+            job.result(timeout=5)
+        assert progress == [('slow', 1, 2)]
+        graph.shutdown()
+
+    def test_cancelled_job_caches_nothing(self):
+        started = threading.Event()
+        release = threading.Event()
+        graph = analysis.AnalysisGraph(workers=1)
+        graph.add('slow', lambda x: started.set() or release.wait(5) and x, inputs=('x',))
+        job = graph.submit('slow', 'old', {'x': 1}, {})
+        assert (job.recording_key, job.inputs, job.params) == ('old', {'x': 1}, {})
+        started.wait(5)
+        job.cancel()
+        graph.clear('old')
+        release.set()
+        # The running node finishes, but its result isn't left behind under the cleared key
+        job.future.exception(timeout=5)
+        assert not graph.cached('slow', 'old', {})
+        graph.shutdown()
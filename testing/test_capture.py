@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pytest
+import capture
+import systolic
+
+
+class FakeSerial:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read(self, size=1):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+class Recorder:
+    """
+    ecg_read listener keeping each parsed sample before any filtering
+    """
+    def __init__(self):
+        self.samples = []
+
+    def update(self, y_vals, count):
+        self.samples.append(y_vals[:3, count - 1].copy())
+
+
+def make_capture(path, chunks):
+    ser = FakeSerial(chunks)
+    with capture.CaptureSerial(ser, path) as capture_ser:
+        for _ in range(len(chunks) + 2):
+            capture_ser.read(64)
+            time.sleep(0.01)
+
+
+class TestClass:
+    def test_round_trip(self, tmp_path):
+        chunks = [b'1,2,3\r\n', b'4,5', b',6\r\n']
+        make_capture(tmp_path / 'cap.bin', chunks)
+        records = capture.load_capture(tmp_path / 'cap.bin')
+        assert [data for _, data in records] == chunks
+        assert records[0][0] < records[1][0] < records[2][0]
+        replay = capture.ReplaySerial(tmp_path / 'cap.bin')
+        assert replay.inWaiting() == 7
+        assert replay.read(3) == b'1,2'
+        assert replay.read(replay.inWaiting()) == b',3\r\n'
+        assert replay.read(10) == b'4,5'
+        assert replay.read(10) == b',6\r\n'
+        with pytest.raises(EOFError):
+            replay.inWaiting()
+
+    def test_realtime_replay_keeps_timing(self, tmp_path):
+        make_capture(tmp_path / 'cap.bin', [b'a', b'b', b'c'])
+        replay = capture.ReplaySerial(tmp_path / 'cap.bin', realtime=True)
+        start = time.perf_counter()
+        received = b''
+        while len(received) < 3:
+            received += replay.read(replay.inWaiting())
+        assert received == b'abc'
+        assert time.perf_counter() - start >= 0.015
+
+    def test_ecg_read_from_replay(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(systolic.time, 'sleep', lambda _: None)
+        adc_max = 0x800000
+        counts = np.arange(20) * 1000 + adc_max // 2
+        make_capture(tmp_path / 'cap.bin', [b'%d,%d,%d\r\n' % (c, c, 2 * c) for c in counts])
+        replay = capture.ReplaySerial(tmp_path / 'cap.bin')
+        assert len(replay) == replay.samples == len(counts)
+        parsed = Recorder()
+        waveforms, _ = systolic.ecg_read(adc_max, replay, replay.samples, [parsed])
+        assert waveforms.shape == (6, len(counts))
+        assert list(np.array(parsed.samples)[:, 0]) == list(counts)
+        assert list(np.array(parsed.samples)[:, 2]) == list(2 * counts)
+        assert list(waveforms.counts[1]) == list(counts)
+        assert replay.written[0] == b'0x00,0x01\r\n'
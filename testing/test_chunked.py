@@ -0,0 +1,18 @@
+import numpy as np
+import chunked
+from scipy import signal
+
+
+class TestClass:
+    def test_sosfilt_matches_whole_array(self):
+        data = np.random.default_rng(4).normal(size=(2, 50000))
+        sos = signal.butter(2, [5, 15], btype='bandpass', output='sos', fs=500)
+        result = chunked.chunked_sosfilt(sos, data, chunk_size=4096, workers=4)
+        assert np.allclose(result, signal.sosfilt(sos, data), atol=1e-8)
+
+    def test_filtfilt_matches_whole_array(self):
+        data = np.random.default_rng(5).normal(size=50000)
+        b_notch, a_notch = signal.iirnotch(50.0, 30.0, 500)
+        result = chunked.chunked_filtfilt(b_notch, a_notch, data, chunk_size=3000, workers=4)
+        assert result.shape == data.shape
+        assert np.allclose(result, signal.filtfilt(b_notch, a_notch, data), atol=1e-8)
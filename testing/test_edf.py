@@ -0,0 +1,68 @@
+import datetime
+
+import numpy as np
+import edf
+import recording
+
+
+class TestClass:
+    def test_write_and_seek(self, tmp_path):
+        fs = 250
+        data = np.vstack([np.sin(np.arange(10 * fs + 30) / 50), np.cos(np.arange(10 * fs + 30) / 30)])
+        writer = edf.EDFWriter(str(tmp_path / 'ecg.edf'), ['Lead I', 'Lead II'], fs, -2, 2,
+                               start=datetime.datetime(2020, 10, 5, 12, 30, 0))
+        for start in range(0, data.shape[1], 77):
+            writer.write(data[:, start:start + 77])
+        writer.close()
+        resolution = 4 / 65535
+        with edf.EDFReader(str(tmp_path / 'ecg.edf')) as reader:
+            assert reader.labels == ['Lead I', 'Lead II']
+            assert reader.records == 11
+            assert list(reader.sampling_rates) == [fs, fs, 16]
+            assert reader.header_bytes == 256 * 4
+            assert np.abs(reader.read()[:, :data.shape[1]] - data).max() <= resolution
+            part = reader.read(3.1, 2.5)
+            assert part.shape == (2, int(2.5 * fs))
+            assert np.abs(part - data[:, int(3.1 * fs):int(5.6 * fs)]).max() <= resolution
+        with open(tmp_path / 'ecg.edf', 'rb') as edf_file:
+            header = edf_file.read(256)
+            assert header[168:184] == b'05.10.2012.30.00'
+            assert header[192:197] == b'EDF+C'
+            edf_file.seek(256 * 4 + 2 * 2 * fs)
+            assert edf_file.read(6) == b'+0\x14\x14\x00\x00'
+
+    def test_listener_with_measured_rate(self, tmp_path):
+        adc_max = 0xC35000
+        counts = np.random.default_rng(6).integers(0, adc_max, size=(3, 2600), dtype=np.int32)
+        writer = edf.EDFWriter(str(tmp_path / 'ecg.edf'), ['Lead I', 'Lead II', 'Lead III'], 500,
+                               *edf.adc_range(adc_max), adc_max)
+        for count in range(1, counts.shape[1] + 1):
+            writer.update(counts, count)
+        writer.close(sampling_rate=490)
+        with edf.EDFReader(str(tmp_path / 'ecg.edf')) as reader:
+            assert reader.records == 6
+            assert reader.record_duration == float('%.6f' % (500 / 490))
+            resolution = (reader.gain[0] + 1e-9)
+            expected = recording.counts_to_millivolts(counts, adc_max)
+            assert np.abs(reader.read()[:, :2600] - expected).max() <= resolution
+
+    def test_baseline_removed_range(self, tmp_path):
+        adc_max = 0xC35000
+        t = np.arange(3000) / 500
+        millivolts = np.vstack([200 + np.sin(2 * np.pi * t), -50 + 2 * np.cos(2 * np.pi * t)])
+        counts = np.round((millivolts / 1e3 * 3.5 / 4.8 + 0.5) * adc_max)
+        ecg = recording.Recording(counts, adc_max, 500)
+        edf.export_recording(str(tmp_path / 'export.edf'), ecg, ['Lead I', 'Lead II'])
+        writer = edf.EDFWriter(str(tmp_path / 'live.edf'), ['Lead I', 'Lead II'], 500, -5, 5, adc_max,
+                               remove_baseline=True)
+        for count in range(1, counts.shape[1] + 1):
+            writer.update(counts, count)
+        writer.close()
+        exact = recording.counts_to_millivolts(ecg.counts[:2], adc_max)
+        for name in ('export.edf', 'live.edf'):
+            with edf.EDFReader(str(tmp_path / name)) as reader:
+                # Far finer than the ~21 uV steps of the whole ADC range
+                assert reader.gain.max() < 1e-3 / 2
+                data = reader.read()[:, :3000]
+            centred = exact - (exact - data).mean(axis=1, keepdims=True)
+            assert np.abs(data - centred).max() <= reader.gain[0]
@@ -0,0 +1,35 @@
+import numpy as np
+import ensemble
+
+
+class TestClass:
+    def test_windows_are_aligned_views(self):
+        data = np.arange(20.0).reshape(2, 10)
+        windows, peaks = ensemble.beat_windows(data, [1, 4, 8], 2, 2)
+        assert list(peaks) == [4, 8]
+        assert windows.shape == (2, 2, 4)
+        assert list(windows[1, 1]) == [16, 17, 18, 19]
+
+    def test_recording_shorter_than_window(self):
+        windows, peaks = ensemble.beat_windows(np.zeros((6, 5)), [2], 3, 4)
+        assert windows.shape == (6, 0, 7)
+        assert len(peaks) == 0
+        median, mean, correlation, used = ensemble.ensemble_average(np.zeros((6, 5)), [2], 500)
+        assert median.shape == mean.shape == (6, 350)
+        assert correlation.shape == (6, 0)
+        assert len(used) == 0
+
+    def test_template_recovers_beat(self):
+        fs = 500
+        rng = np.random.default_rng(1)
+        beat = np.exp(-np.linspace(-5, 5, 350) ** 2)
+        peaks = np.arange(200, 2000 * fs // 4, fs)
+        data = rng.normal(scale=0.2, size=(6, peaks[-1] + fs))
+        for peak in peaks:
+            data[:, peak - 125:peak + 225] += beat
+        median, mean, correlation, used = ensemble.ensemble_average(data, peaks, fs)
+        assert len(used) == len(peaks)
+        assert np.abs(mean - beat).max() < 0.05
+        assert np.abs(median - beat).max() < 0.05
+        assert correlation.shape == (6, len(peaks))
+        assert 0.7 < correlation.mean() < 1
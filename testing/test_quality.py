@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import quality
+from recording import counts_to_millivolts
+
+
+class TestClass:
+    def test_flat_and_saturated_windows(self):
+        fs = 250
+        t = np.arange(4 * fs) / fs
+        lead = np.sin(2 * np.pi * 1.2 * t)
+        lead[fs:2 * fs] = 0  # loose electrode
+        lead[3 * fs:] = 10  # railed
+        result = quality.signal_quality([lead, lead], fs, full_scale=10)
+        assert len(result) == 4
+        assert list(result.good) == [True, False, True, False]
+        assert result.sample_mask(len(lead) + 5).sum() == 2 * fs + 5
+
+    def test_noise_and_wander(self):
+        fs = 500
+        t = np.arange(fs) / fs
+        noisy = np.sin(2 * np.pi * 100 * t)
+        drifting = 5 * t
+        result = quality.signal_quality([noisy, drifting], fs)
+        assert result.values('hf_noise')[0, 0] == pytest.approx(1)
+        assert result.values('wander')[0, 1] == pytest.approx(5, rel=0.01)
+
+    def test_mains_hum_is_not_noise(self):
+        fs = 500
+        t = np.arange(10 * fs) / fs
+        ecg = sum(np.exp(-((t - beat) / 0.01) ** 2) for beat in np.arange(0.5, 10, 1))
+        for mains in (50.3, 60):
+            result = quality.signal_quality(ecg + 0.5 * np.sin(2 * np.pi * mains * t), fs)
+            assert result.good.all()
+        noisy = quality.signal_quality(ecg + 0.5 * np.sin(2 * np.pi * 75 * t), fs)
+        assert not noisy.good.any()
+
+    def test_monitor_matches_batch(self, tmp_path):
+        fs = 200
+        adc_max = 0x800000
+        counts = np.random.default_rng(0).integers(0, adc_max, size=(3, 3 * fs + 10), dtype=np.int32)
+        monitor = quality.QualityMonitor(fs, fs, adc_max)
+        for count in range(1, counts.shape[1] + 1):
+            monitor.update(counts, count)
+        batch = quality.signal_quality(counts_to_millivolts(counts, adc_max), fs, full_scale=monitor.full_scale)
+        for metric in quality.METRICS:
+            assert np.allclose(monitor.values(metric), batch.values(metric))
+        quality.save_quality(tmp_path / 'q.csv', monitor)
+        loaded = quality.load_quality(tmp_path / 'q.csv')
+        assert np.allclose(loaded.values('wander'), monitor.values('wander'))
+        assert list(loaded.good) == list(monitor.good)
+
+    def test_rescale_to_resampled_rate(self, tmp_path):
+        # Monitored at the nominal 500 Hz, the measured rate was 500.6 Hz and the recording resampled to 1000 Hz
+        monitor = quality.QualityMonitor(500, 500.0, 0x800000)
+        monitor.rescale(1000 / 500.6, 1000)
+        assert monitor.sampling_freq == 1000
+        assert monitor.window == pytest.approx(500 * 1000 / 500.6)
+        quality.save_quality(tmp_path / 'q.csv', monitor)
+        assert quality.load_quality(tmp_path / 'q.csv').sampling_freq == 1000
@@ -0,0 +1,81 @@
+import csv
+import tracemalloc
+
+import numpy as np
+import pytest
+import recording
+import systolic
+
+
+def make_recording():
+    fs = 500
+    t = np.arange(10 * fs) / fs
+    adc_max = 0x800000
+    lead_i = np.sin(2 * np.pi * t)
+    lead_ii = 10 * sum(np.exp(-((t - beat) / 0.01) ** 2) for beat in np.arange(0.5, 10, 1))
+    millivolts = np.vstack([lead_i, lead_ii, lead_ii - lead_i])
+    counts = np.round((millivolts / 1e3 * 3.5 / 4.8 + 0.5) * adc_max)
+    return recording.Recording(counts, adc_max, fs), millivolts
+
+
+class TestClass:
+    def test_memory_kept_after_use(self):
+        ecg, _ = make_recording()
+        # Run once first so lazily set up module state isn't counted
+        systolic.pan_tompkins(ecg, ecg.sampling_rate)
+        waveforms_bytes = np.zeros(ecg.shape).nbytes * 10
+        tracemalloc.start()
+        try:
+            ecg = recording.Recording(np.tile(ecg.counts, 10), ecg.adc_max, ecg.sampling_rate)
+            assert tracemalloc.get_traced_memory()[0] <= waveforms_bytes / 4 * 1.05
+            systolic.pan_tompkins(ecg, ecg.sampling_rate)
+            np.asarray(ecg)  # what view_data and save_data do
+            # Only the counts and the float32 cache are kept once the leads have been used
+            assert tracemalloc.get_traced_memory()[0] <= waveforms_bytes / 2 * 1.05
+        finally:
+            tracemalloc.stop()
+        ecg.clear_cache()
+        assert 'measured' not in ecg.__dict__
+
+    def test_save_data_writes_in_chunks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(systolic, 'SAVE_CHUNK', 1000)
+        ecg, _ = make_recording()
+        ecg = recording.Recording(np.tile(ecg.counts, 10), ecg.adc_max, ecg.sampling_rate)
+        expected = np.asarray(ecg)
+        tracemalloc.start()
+        try:
+            systolic.save_data(str(tmp_path / 'sample.csv'), ['Lead I'] * 6, ecg, ecg.sampling_rate)
+            # Far below the six float64 leads, let alone them as Python floats
+            assert tracemalloc.get_traced_memory()[1] < expected.nbytes / 4
+        finally:
+            tracemalloc.stop()
+        with open(tmp_path / 'sample.csv', newline='') as csv_object:
+            rows = list(csv.reader(csv_object))
+        assert len(rows) == expected.shape[1] + 2
+        assert np.allclose([float(value) for value in rows[-1]], expected[:, -1])
+
+    def test_lead_index_out_of_range(self):
+        ecg, _ = make_recording()
+        for index in (6, -7):
+            with pytest.raises(IndexError):
+                ecg.lead(index)
+
+    def test_leads(self):
+        ecg, millivolts = make_recording()
+        assert np.abs(ecg[0] - (millivolts[0] - millivolts[0].mean())).max() < 0.05
+        lead_i, lead_ii, lead_iii = ecg[0], ecg[1], ecg[2]
+        assert np.allclose(ecg[3], -(lead_i + lead_ii) / 2)
+        assert np.allclose(ecg[4], (lead_i - lead_iii) / 2, atol=1e-3)
+        assert np.allclose(ecg[5], (lead_ii + lead_iii) / 2, atol=1e-3)
+        assert np.asarray(ecg).shape == (6, 5000)
+        assert np.allclose(np.asarray(ecg)[5], ecg[-1])
+
+    def test_drop_in_for_waveforms(self, tmp_path):
+        ecg, _ = make_recording()
+        rate = systolic.pan_tompkins(ecg, ecg.sampling_rate)
+        assert rate == systolic.pan_tompkins(np.asarray(ecg), ecg.sampling_rate)
+        systolic.save_data(str(tmp_path / 'sample.csv'), ['Lead I'] * 6, ecg, ecg.sampling_rate)
+        with open(tmp_path / 'sample.csv', newline='') as csv_object:
+            rows = list(csv.reader(csv_object))
+        assert len(rows) == 5002
+        assert np.allclose([float(value) for value in rows[2]], np.asarray(ecg)[:, 0])
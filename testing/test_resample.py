@@ -0,0 +1,42 @@
+import numpy as np
+import resample
+
+
+class TestClass:
+    def test_chunks_match_single_pass(self):
+        fs = 533.7
+        data = np.random.default_rng(2).normal(size=(3, 2000))
+        whole = resample.StreamingResampler(fs, 500, leads=3).process(data)
+        chunked = resample.StreamingResampler(fs, 500, leads=3)
+        pieces = [chunked.process(data[:, i:i + 97]) for i in range(0, data.shape[1], 97)]
+        assert np.allclose(np.concatenate(pieces, axis=1), whole)
+
+    def test_sine_keeps_its_timing(self):
+        fs = 1593.7
+        t = np.arange(int(10 * fs)) / fs
+        data, rate = resample.resample_recording(np.sin(2 * np.pi * 5 * t), fs, 1600)
+        assert rate == 1600
+        assert data.shape == (1, 16000)
+        expected = np.sin(2 * np.pi * 5 * np.arange(16000) / 1600)
+        assert np.abs(data[0, 100:-100] - expected[100:-100]).max() < 0.01
+
+    def test_near_equal_rates_keep_their_timing(self):
+        # Rounding these ratios to 1/1 would lose 15 ms a minute
+        for fs in (799.8, 800.3):
+            t = np.arange(int(60 * fs)) / fs
+            data, rate = resample.resample_recording(np.sin(2 * np.pi * 5 * t), fs, 800)
+            expected = np.sin(2 * np.pi * 5 * np.arange(data.shape[1]) / 800)
+            assert abs(data.shape[1] - 60 * 800) <= 1
+            assert np.abs(data[0, 100:-100] - expected[100:-100]).max() < 0.01
+
+    def test_equal_rates_pass_through(self):
+        data = np.random.default_rng(3).normal(size=(3, 1000))
+        result, rate = resample.resample_recording(data, 533, 533)
+        assert rate == 533
+        assert np.array_equal(result, data)
+
+    def test_empty_chunk(self):
+        resampler = resample.StreamingResampler(533.7, 500, leads=3)
+        assert resampler.process(np.zeros((3, 0))).shape == (3, 0)
+        assert resampler.process(np.ones((3, 200))).shape[0] == 3
+        assert resampler.process(np.zeros((3, 0))).shape == (3, 0)
@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+import streaming
+
+
+def wait_for_clients(server, count):
+    for _ in range(100):
+        if len(server.clients) == count:
+            return
+        time.sleep(0.01)
+
+
+class TestClass:
+    def test_clients_receive_blocks(self):
+        server = streaming.StreamServer(block_size=10, sampling_freq=500)
+        clients = [streaming.StreamClient(*server.address, timeout=5) for _ in range(2)]
+        wait_for_clients(server, 2)
+        data = np.random.default_rng(3).normal(size=(3, 35))
+        for count in range(1, 36):
+            server.update(data, count)
+        for client in clients:
+            for seq in range(3):
+                number, start, fs, block = client.read_block()
+                assert (number, start, fs) == (seq, seq * 10, 500)
+                assert np.allclose(block, data[:, start:start + 10], atol=1e-6)
+            client.close()
+        server.close()
+
+    def test_slow_client_drops_blocks(self):
+        server = streaming.StreamServer(queue_size=2)
+        slow = streaming.StreamClient(*server.address, timeout=5)
+        wait_for_clients(server, 1)
+        block = np.zeros((3, 100000))
+        start = time.perf_counter()
+        for _ in range(50):
+            server.broadcast(block)
+        # Nothing is being read, yet broadcasting never waited on the client
+        assert time.perf_counter() - start < 1
+        assert server.clients[0].dropped > 0
+        assert slow.read_block()[0] == 0
+        slow.close()
+        server.close()
+
+    def test_flush_sends_the_last_partial_block(self):
+        server = streaming.StreamServer(block_size=10, sampling_freq=500)
+        client = streaming.StreamClient(*server.address, timeout=5)
+        wait_for_clients(server, 1)
+        data = np.random.default_rng(4).normal(size=(3, 25))
+        for count in range(1, 26):
+            server.update(data, count)
+        server.flush()
+        received = np.concatenate([client.read_block()[3] for _ in range(3)], axis=1)
+        assert np.allclose(received, data, atol=1e-6)
+        client.close()
+        server.close()